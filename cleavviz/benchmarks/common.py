@@ -0,0 +1,36 @@
+import random
+
+import pandas as pd
+
+from cleavviz.data import read_fasta
+from cleavviz.cleavage_calculation.constants import alphabet
+
+
+def random_fasta(n_proteins, seed=0):
+    rng = random.Random(seed)
+    sequences = ["".join(rng.choices(alphabet, k=rng.randint(50, 1000))) for _ in range(n_proteins)]
+    return pd.DataFrame({"id": [f"P{i:06d}" for i in range(n_proteins)], "sequence": sequences})
+
+
+def load_fasta(path, n_proteins):
+    if path is None:
+        return random_fasta(n_proteins)
+    with open(path, "rb") as file:
+        return read_fasta(file)
+
+
+def random_peptides(fasta, n_peptides, seed=0):
+    '''Unique peptides cut from the proteome, including short ones, plus 5% that do not occur.'''
+
+    rng = random.Random(seed)
+    sequences = fasta["sequence"].tolist()
+    peptides = set()
+    while len(peptides) < n_peptides:
+        sequence = rng.choice(sequences)
+        length = rng.randint(4, 40)
+        if rng.random() < 0.05:
+            peptides.add("".join(rng.choices(alphabet, k=length)))
+            continue
+        start = rng.randint(0, max(0, len(sequence) - length))
+        peptides.add(sequence[start:start + length])
+    return sorted(peptides)
@@ -0,0 +1,63 @@
+'''
+Compare the memory footprint of the packed KmerIndex with the former dictionary index.
+
+usage:
+    python benchmarks/kmer_index_memory.py [fasta_file] [--proteins N]
+
+Without a fasta file a random proteome with N proteins is generated.
+'''
+
+import argparse
+import time
+import tracemalloc
+from collections import defaultdict
+
+from cleavviz.cleavage_calculation.kmer import KmerIndex
+from cleavviz.cleavage_calculation.proteome import Proteome
+
+from common import load_fasta
+
+
+def build_dict_index(fasta, k=6):
+    kmer_index = defaultdict(list)
+    for protein in fasta.itertuples():
+        sequence = protein.sequence
+        for i in range(len(sequence) - k + 1):
+            kmer_index[sequence[i:i+k]].append((protein.id, i))
+    return kmer_index
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fasta", nargs="?")
+    parser.add_argument("--proteins", type=int, default=20000)
+    args = parser.parse_args()
+
+    fasta = load_fasta(args.fasta, args.proteins)
+
+    proteome = Proteome.from_fasta(fasta)
+    print(f"{len(proteome)} proteins, {int(proteome.lengths.sum())} residues")
+
+    _, dict_current, dict_peak, dict_time = measure(lambda: build_dict_index(fasta))
+    kmer_index, packed_current, packed_peak, packed_time = measure(lambda: KmerIndex.from_proteome(proteome))
+
+    mb = 1024 ** 2
+    print(f"{'index':<10}{'retained MB':>14}{'peak MB':>12}{'build s':>10}")
+    print(f"{'dict':<10}{dict_current / mb:>14.1f}{dict_peak / mb:>12.1f}{dict_time:>10.2f}")
+    print(f"{'packed':<10}{packed_current / mb:>14.1f}{packed_peak / mb:>12.1f}{packed_time:>10.2f}")
+    print(f"array payload of the packed index: {kmer_index.nbytes / mb:.1f} MB")
+    print(f"reduction of retained memory: {dict_current / max(packed_current, 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+'''
+Compare peptide mapping with the k-mer index, the suffix array and the Aho-Corasick automaton.
+
+usage:
+    python benchmarks/peptide_mapping.py [fasta_file] [--proteins N] [--peptides N] [--workers N]
+
+Without a fasta file a random proteome with N proteins is generated. The peptides are cut
+from the proteome at random, including peptides shorter than the k-mer length.
+'''
+
+import argparse
+import time
+
+from cleavviz.cleavage_calculation.mapping import MAPPING_METHODS, build_peptide_index
+from cleavviz.cleavage_calculation.proteome import Proteome
+
+from common import load_fasta, random_peptides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fasta", nargs="?")
+    parser.add_argument("--proteins", type=int, default=20000)
+    parser.add_argument("--peptides", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes used to build the indexes")
+    args = parser.parse_args()
+
+    fasta = load_fasta(args.fasta, args.proteins)
+    proteome = Proteome.from_fasta(fasta)
+    peptides = random_peptides(fasta, args.peptides)
+    print(f"{len(proteome)} proteins, {int(proteome.lengths.sum())} residues, {len(peptides)} unique peptides")
+
+    print(f"{'method':<14}{'build s':>10}{'map s':>10}{'mapped':>10}{'hits':>10}")
+    for method in MAPPING_METHODS:
+        start = time.perf_counter()
+        index = build_peptide_index(proteome, method, args.workers)
+        built = time.perf_counter()
+        hits = index.map_peptides(peptides, proteome)
+        mapped = time.perf_counter()
+        n_mapped = len(set(hits.peptides.tolist()))
+        print(f"{method:<14}{built - start:>10.2f}{mapped - built:>10.2f}{n_mapped:>10}{len(hits):>10}")
+
+
+if __name__ == "__main__":
+    main()
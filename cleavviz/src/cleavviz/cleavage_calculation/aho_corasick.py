@@ -0,0 +1,231 @@
+import numpy as np
+from .proteome import HitTable
+
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+class EdgeTable:
+    '''
+    Open addressing hash table with linear probing mapping int64 keys to int64 values.
+
+    Insertion and lookup work on whole arrays of keys at once.
+    '''
+
+    def __init__(self, keys, values):
+        self.bits = max(1, int(2 * len(keys)).bit_length())
+        self.mask = (1 << self.bits) - 1
+        self.keys = np.full(1 << self.bits, -1, dtype=np.int64)
+        self.values = np.full(1 << self.bits, -1, dtype=np.int64)
+
+        pending = np.arange(len(keys))
+        slots = self._hash(keys)
+        while len(pending):
+            free = self.keys[slots[pending]] == -1
+            claimed, first = np.unique(slots[pending[free]], return_index=True)
+            placed = pending[free][first]
+            self.keys[claimed] = keys[placed]
+            self.values[claimed] = values[placed]
+            pending = np.setdiff1d(pending, placed, assume_unique=True)
+            slots[pending] = (slots[pending] + 1) & self.mask
+
+    def _hash(self, keys):
+        return ((keys.astype(np.uint64) * HASH_MULTIPLIER) >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def get(self, keys):
+        '''Look up all keys, -1 where a key is missing.'''
+
+        result = np.full(len(keys), -1, dtype=np.int64)
+        slots = self._hash(keys)
+        pending = np.arange(len(keys))
+        while len(pending):
+            found = self.keys[slots[pending]]
+            hit = found == keys[pending]
+            result[pending[hit]] = self.values[slots[pending[hit]]]
+            pending = pending[~hit & (found != -1)]
+            slots[pending] = (slots[pending] + 1) & self.mask
+        return result
+
+
+class AhoCorasick:
+    '''
+    Aho-Corasick automaton over a set of unique peptide sequences.
+
+    The trie is built from the sorted patterns, every state is stored in flat arrays and the
+    goto function is a hash table of (state << 8 | byte) keys, so the automaton can be
+    driven by NumPy for many positions of the text at once.
+    '''
+
+    def __init__(self, sequences):
+        self.n_patterns = len(sequences)
+        self.lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+        self.max_length = int(self.lengths.max(initial=0))
+        self._build_trie(sequences)
+        self._link()
+
+    def _build_trie(self, sequences):
+        patterns = np.array([i for i in sorted(range(len(sequences)), key=sequences.__getitem__) if sequences[i]], dtype=np.int64)
+        lengths = self.lengths[patterns]
+        buffer = np.frombuffer("".join(sequences[i] for i in patterns).encode("ascii", errors="replace"), dtype=np.uint8)
+        starts = np.cumsum(lengths) - lengths
+
+        # longest common prefix with the previous pattern in sorted order
+        lcp = np.zeros(len(patterns), dtype=np.int64)
+        still_equal = np.ones(len(patterns), dtype=bool)
+        still_equal[:1] = False
+        for j in range(self.max_length):
+            still_equal[1:] &= (lengths[:-1] > j) & (lengths[1:] > j)
+            still_equal[1:] &= buffer[np.minimum(starts[:-1] + j, len(buffer) - 1)] == buffer[np.minimum(starts[1:] + j, len(buffer) - 1)]
+            lcp += still_equal
+            if not still_equal.any():
+                break
+
+        # every pattern adds one state for each residue after the shared prefix
+        new_states = lengths - lcp
+        first_state = 1 + np.cumsum(new_states) - new_states
+        n_states = 1 + int(new_states.sum())
+
+        # the shared prefix ends in a state created by the last previous pattern with a shorter lcp
+        prefix_state = np.zeros(len(patterns), dtype=np.int64)
+        stack = []
+        for i, shared in enumerate(lcp.tolist()):
+            while stack and lcp[stack[-1]] >= shared:
+                stack.pop()
+            if shared > 0:
+                j = stack[-1]
+                prefix_state[i] = first_state[j] + shared - lcp[j] - 1
+            stack.append(i)
+
+        pattern_of_state = np.repeat(np.arange(len(patterns)), new_states)
+        step = np.arange(n_states - 1) - np.repeat(first_state - 1, new_states)
+        depth = np.zeros(n_states, dtype=np.int64)
+        depth[1:] = lcp[pattern_of_state] + step + 1
+        symbols = np.zeros(n_states, dtype=np.int64)
+        symbols[1:] = buffer[starts[pattern_of_state] + depth[1:] - 1]
+        parents = np.zeros(n_states, dtype=np.int64)
+        parents[1:] = np.where(step == 0, prefix_state[pattern_of_state], np.arange(n_states - 1))
+
+        terminal = np.full(n_states, -1, dtype=np.int64)
+        terminal[first_state + new_states - 1] = patterns
+
+        self.edges = EdgeTable(parents[1:] << 8 | symbols[1:], np.arange(1, n_states, dtype=np.int64))
+        self.depth = depth
+        self.symbols = symbols
+        self.parents = parents
+        self.terminal = terminal
+
+    def _goto(self, states, symbols):
+        '''Follow the edges labelled symbols out of states, -1 where no edge exists.'''
+
+        return self.edges.get(states << 8 | symbols)
+
+    def _transition(self, states, symbols):
+        '''Goto with failure links, returns the next state for every lane.'''
+
+        next_states = self._goto(states, symbols)
+        missing = np.flatnonzero((next_states < 0) & (states > 0))
+        while len(missing):
+            states[missing] = self.fail[states[missing]]
+            next_states[missing] = self._goto(states[missing], symbols[missing])
+            missing = missing[(next_states[missing] < 0) & (states[missing] > 0)]
+        return np.maximum(next_states, 0)
+
+    def _link(self):
+        '''Compute failure links and, for every state, the nearest state that reports a match.'''
+
+        self.fail = np.zeros(len(self.depth), dtype=np.int64)
+        self.report = np.zeros(len(self.depth), dtype=np.int64)
+        order = np.argsort(self.depth, kind="stable")
+        level_starts = np.searchsorted(self.depth[order], np.arange(self.max_length + 2))
+
+        for d in range(1, self.max_length + 1):
+            states = order[level_starts[d]:level_starts[d + 1]]
+            if d > 1:
+                self.fail[states] = self._transition(self.fail[self.parents[states]], self.symbols[states])
+            self.report[states] = np.where(self.terminal[states] >= 0, states, self.report[self.fail[states]])
+
+    def find(self, text, lanes=32768):
+        '''
+        Scan a text and report every occurrence of every pattern.
+
+        The text is split into `lanes` segments that are scanned side by side. Each segment starts
+        max_length - 1 positions early, so matches crossing a segment border are found as well.
+
+        args:
+            text: String to search.
+            lanes: Number of segments scanned in parallel.
+
+        returns:
+            ends: Position of the last character of each occurrence.
+            patterns: Index of the pattern of each occurrence.
+        '''
+
+        buffer = np.frombuffer(text.encode("ascii", errors="replace"), dtype=np.uint8)
+        ends, patterns = [], []
+        if len(buffer) == 0 or self.max_length == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        segment = -(-len(buffer) // lanes)
+        segment_starts = np.arange(0, len(buffer), segment, dtype=np.int64)
+        segment_ends = np.minimum(segment_starts + segment, len(buffer))
+        warmup = self.max_length - 1
+        begin = segment_starts - warmup
+        states = np.zeros(len(segment_starts), dtype=np.int64)
+
+        for t in range(segment + warmup):
+            positions = begin + t
+            inside = (positions >= 0) & (positions < segment_ends)
+            symbols = buffer[np.clip(positions, 0, len(buffer) - 1)].astype(np.int64)
+            states = np.where(inside, self._transition(states.copy(), symbols), states)
+
+            recording = np.flatnonzero(inside & (positions >= segment_starts))
+            matches = self.report[states[recording]]
+            found = matches > 0
+            recording, matches = recording[found], matches[found]
+            while len(matches):
+                ends.append(positions[recording])
+                patterns.append(self.terminal[matches])
+                matches = self.report[self.fail[matches]]
+                found = matches > 0
+                recording, matches = recording[found], matches[found]
+
+        if not ends:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(ends), np.concatenate(patterns)
+
+
+class AhoCorasickMapper:
+    '''
+    Maps a batch of peptides with a single pass over the proteome, no index of the proteome is kept.
+    '''
+
+    @classmethod
+    def from_proteome(cls, proteome, n_workers=1):
+        return cls()
+
+    def to_arrays(self):
+        return {}
+
+    @classmethod
+    def from_arrays(cls, arrays, proteome):
+        return cls()
+
+    def map_peptides(self, sequences, proteome):
+        '''
+        Find every occurrence of every peptide.
+
+        args:
+            sequences: List of unique peptide sequences.
+            proteome: Concatenated and encoded protein sequences.
+
+        returns:
+            HitTable: One row per occurrence, ordered by peptide, protein and offset.
+        '''
+
+        automaton = AhoCorasick(sequences)
+        ends, peptides = automaton.find(proteome.sequence)
+
+        positions = ends - automaton.lengths[peptides] + 1
+        proteins = proteome.protein_index(positions)
+        offsets = positions - proteome.offsets[proteins]
+        order = np.lexsort((offsets, proteins, peptides))
+
+        return HitTable(peptides[order], proteins[order].astype(np.int32), offsets[order])
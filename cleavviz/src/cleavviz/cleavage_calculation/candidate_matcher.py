@@ -0,0 +1,122 @@
+import numpy as np
+from .constants import alphabet, alphabet_with_X, aa_to_idx
+
+N_SITES = 8
+
+def token_mask(token_list):
+    '''
+    Amino acids allowed by one position of a regex pattern.
+
+    args:
+        token_list: ["X"] for any amino acid, a list of amino acids or a list of forbidden amino acids "!<aa>".
+
+    returns:
+        np.ndarray: Boolean mask over alphabet_with_X, X itself is never allowed.
+    '''
+
+    mask = np.zeros(len(alphabet_with_X), dtype=bool)
+    if token_list == ["X"]:
+        mask[:len(alphabet)] = True
+    elif all(token.startswith("!") for token in token_list):
+        mask[:len(alphabet)] = True
+        mask[[aa_to_idx[token[1:]] for token in token_list]] = False
+    else:
+        mask[[aa_to_idx[token] for token in token_list]] = True
+    return mask
+
+
+class CandidateMatcher:
+    '''
+    Bit-parallel matching of cleavage windows against the regex patterns of all enzymes.
+
+    table[s, a] is a bitset over the enzymes with bit i set if enzyme i allows amino acid a at
+    site s. The candidates of a window are the AND of its eight table rows, computed for all
+    windows at once. Gives the same candidates as RegexTrie.match: windows containing X match
+    nothing and patterns that allow anything at every site are left out.
+    '''
+
+    def __init__(self, regexes):
+        '''
+        args:
+            regexes: Dictionary of regex patterns for all enzyme candidates, see motifs.pssm_to_regex.
+        '''
+
+        codes = [code for code, regex in regexes.items() if regex != [["X"]] * N_SITES]
+
+        masks = np.zeros((len(codes), N_SITES, len(alphabet_with_X)), dtype=bool)
+        for i, code in enumerate(codes):
+            for site, token_list in enumerate(regexes[code]):
+                masks[i, site] = token_mask(token_list)
+
+        self._set_masks(codes, masks)
+
+    def _set_masks(self, codes, masks):
+        self.codes = list(codes)
+        self.masks = masks
+
+        self.n_words = -(-len(self.codes) // 64)
+        packed = np.zeros((N_SITES, len(alphabet_with_X), self.n_words * 8), dtype=np.uint8)
+        packed[:, :, :-(-len(self.codes) // 8)] = np.packbits(masks.transpose(1, 2, 0), axis=2, bitorder="little")
+        self.table = packed.view(np.uint64)
+
+    @classmethod
+    def from_masks(cls, codes, masks):
+        '''
+        Matcher over precomputed amino acid masks.
+
+        args:
+            codes: Enzyme codes.
+            masks: [n_enzymes, 8, 21] boolean, the amino acids each enzyme allows at each site, see token_mask.
+        '''
+
+        matcher = cls.__new__(cls)
+        matcher._set_masks(codes, np.asarray(masks, dtype=bool))
+        return matcher
+
+    def take(self, enzymes):
+        '''Matcher over the enzymes with the given indices.'''
+        return CandidateMatcher.from_masks([self.codes[i] for i in enzymes], self.masks[enzymes])
+
+    @classmethod
+    def from_table(cls, codes, table):
+        '''Matcher over a precomputed table, e.g. one attached from shared memory.'''
+        matcher = cls.__new__(cls)
+        matcher.codes = list(codes)
+        matcher.masks = None
+        matcher.n_words = table.shape[2]
+        matcher.table = table
+        return matcher
+
+    def __len__(self):
+        return len(self.codes)
+
+    def match_bits(self, windows):
+        '''
+        args:
+            windows: (n, 8) array of amino acid indices.
+
+        returns:
+            np.ndarray: (n, n_words) uint64 bitsets of the enzymes matching each window.
+        '''
+
+        windows = np.asarray(windows, dtype=np.intp).reshape(-1, N_SITES)
+        bits = self.table[0, windows[:, 0]]
+        for site in range(1, N_SITES):
+            bits &= self.table[site, windows[:, site]]
+        return bits
+
+    def match_mask(self, windows):
+        '''
+        args:
+            windows: (n, 8) array of amino acid indices.
+
+        returns:
+            np.ndarray: (n, n_enzymes) boolean mask, True where enzyme codes[i] matches the window.
+        '''
+
+        bits = self.match_bits(windows)
+        return np.unpackbits(bits.view(np.uint8), axis=1, count=len(self.codes), bitorder="little").astype(bool)
+
+    def match(self, window):
+        '''Codes of the enzymes matching a single window.'''
+        return [self.codes[i] for i in np.flatnonzero(self.match_mask(window)[0])]
@@ -1,86 +1,192 @@
+from numbers import Integral
 from dataclasses import dataclass
+import pandas as pd
 
-from .helper import search_function
-from .constants import alphabet
+from .search import SearchIndex
 from .preprocessing import get_enzyme_df, get_filtered_enzyme_df, get_cleavage_sites
-from .kmer import build_kmer_index_and_background
-from .regex_trie import RegexTrie
-from .motifs import analyze_enzymes
-from .matching import match_enzymes
+from .kmer import count_background
+from .proteome import Proteome
+from .mapping import build_peptide_index
+from .index_cache import IndexCache, fasta_digest
+from .memo import Memo, MatchMemo
+from .enzyme_db import load_enzyme_db
+from .enzyme_models import EnzymeModelCache
+from .matching import match_enzymes, carry_over_matches
+from .cleavage_result import ASSIGNMENTS
 from .postprocessing import accumulate_results
+from .stages import StageGraph
+
+# stages of the calculation and the stages each of them is computed from
+STAGES = {
+    "fasta": (),
+    "index": ("fasta",),
+    "peptides": (),
+    "windows": ("index", "peptides"),
+    "selection": (),
+    "model": ("selection", "index"),
+    "matches": ("windows", "model"),
+}
+
+# settings and the stage that has to be recomputed when they change
+SETTING_STAGES = {
+    "mapping_method": "index",
+    "guided_mapping": "windows",
+    "species": "selection",
+    "enzymes": "selection",
+    "use_standard_enzymes": "selection",
+    "top_k": "matches",
+}
 
 @dataclass
 class CleavageEnrichmentAnalysis:
     _fasta = None
+    _fasta_digest = None
+    _peptides = None
     _peptide_df = None
     _metadata = None
 
+    mapping_method = "suffix_array"
+    n_workers = None
+    guided_mapping = True
+    mapping_stats = None
+    match_stats = None
     use_standard_enzymes = True
+    top_k = 1
+    assignment = "best"
     species = None
     enzymes = None
     possible_species = None
     possible_enzymes = None
+    index_cache = None
 
     _enzyme_df = None
-    _kmer_index = None
-    _protein_sequences = None
+    _proteome = None
+    _peptide_index = None
     _background = None
     _result = None
-    _calculated = False
+    _model = None
+    _stages = None
+    _mapping_memo = None
+    _match_memo = None
+    _model_cache = None
+    _species_index = None
+    _enzyme_index = None
 
     def __post_init__(self):
+        self._stages = StageGraph(STAGES)
+        self.index_cache = IndexCache()
+        self._mapping_memo = Memo()
+        self._match_memo = MatchMemo()
+        self._model_cache = EnzymeModelCache(load_enzyme_db().log_frequencies)
         (self._enzyme_df,
          self.possible_species,
          self.possible_enzymes) = get_enzyme_df()
+        self._species_index = SearchIndex(self.possible_species)
+        self._enzyme_index = SearchIndex(self.possible_enzymes)
         
     def __setattr__(self, key, value):
-        if ((key == "species" and self.species != value) or
-            (key == "enzymes" and self.enzymes != value) or
-            (key == "use_standard_enzymes" and self.use_standard_enzymes != value)):
-            object.__setattr__(self, "_calculated", False)
+        if key == "top_k" and (isinstance(value, bool) or not isinstance(value, Integral) or value < 1):
+            raise ValueError(f"top_k has to be a positive integer, got {value!r}.")
+        if key == "assignment" and value not in ASSIGNMENTS:
+            raise ValueError(f"Unknown assignment {value!r}, use one of {ASSIGNMENTS}.")
+        if key in SETTING_STAGES and getattr(self, key) != value and self._stages is not None:
+            self._stages.invalidate(SETTING_STAGES[key])
 
         object.__setattr__(self, key, value)
 
     def set_fasta(self, fasta):
         self._fasta = fasta
-        (self._kmer_index,
-         self._protein_sequences,
-         self._background) = build_kmer_index_and_background(self._fasta)
-        if self._peptide_df is not None:
-            self._peptide_df = get_cleavage_sites(self._peptide_df, self._kmer_index, self._protein_sequences)
-        
+        self._fasta_digest = fasta_digest(fasta)
+        self._stages.invalidate("fasta")
+
     def set_peptides(self, peptides):
-        if self._fasta is not None:
-            self._peptide_df = get_cleavage_sites(peptides, self._kmer_index, self._protein_sequences)
+        self._peptides = peptides
+        self._stages.invalidate("peptides")
+
+    def add_peptides(self, peptides):
+        '''Append another run or further samples, only sequences not seen before are mapped and matched.'''
+        if self._peptides is not None:
+            peptides = pd.concat([self._peptides, peptides], ignore_index=True)
+        self.set_peptides(peptides)
+
+    def _build_index(self):
+        if self._fasta is None:
+            self._proteome = self._peptide_index = self._background = None
+            return
+
+        cached = self.index_cache.load(self._fasta_digest, self.mapping_method) if self.index_cache else None
+
+        if cached is not None:
+            (self._proteome,
+             self._peptide_index,
+             self._background) = cached
         else:
-            self._peptide_df = peptides
+            self._proteome = Proteome.from_fasta(self._fasta)
+            self._peptide_index = build_peptide_index(self._proteome, self.mapping_method, self.n_workers)
+            self._background = count_background(self._proteome)
+            if self.index_cache:
+                self.index_cache.store(self._fasta_digest, self.mapping_method, self._proteome, self._peptide_index, self._background)
+
+    def _map_peptides(self):
+        if self._fasta is None or self._peptides is None:
+            self._peptide_df = self._peptides
+            return
+
+        # mapped sequences stay valid as long as the index and the mapping settings do not change,
+        # the index is keyed by the content hash of the fasta file and the mapping method like in the index cache
+        self._mapping_memo.validate((self._fasta_digest, self.mapping_method, self.guided_mapping))
+        self._peptide_df, self.mapping_stats = get_cleavage_sites(self._peptides, self._peptide_index, self._proteome,
+                                                                   self.guided_mapping, self._mapping_memo)
+
+    def _compile_model(self):
+        filtered_enzyme_df = get_filtered_enzyme_df(self._enzyme_df, self.use_standard_enzymes, self.species, self.enzymes)
 
-    def get_results(self, proteinID, metadata_filter):
-        if not self._calculated:
-            self.calculate()
-        return accumulate_results(self._result, proteinID, metadata_filter)
+        #position specific scoring matrices, regexes and candidate matcher of the selected enzymes
+        self._model = self._model_cache.get(filtered_enzyme_df, self._background)
 
-    def calculate(self):
-        filtered_enzyme_df = get_filtered_enzyme_df(self._enzyme_df, self.use_standard_enzymes, self.species, self.enzymes)
+    def _match(self):
+        #match enzymes for each cleavage, matches stay valid as long as the model does not change
+        #and are carried over if only the enzyme selection changed
+        rescored = carry_over_matches(self._match_memo, self._model, self.top_k, self.n_workers)
+        self._match_memo.validate((self._model.key, self.top_k))
+        result, self.match_stats = match_enzymes(self._peptide_df, self._model, self._match_memo, self.n_workers, self.top_k)
+        #sorted once, so the cleavages of a protein are a slice for every get_results
+        self._result = result.sort_by_protein()
+        self.match_stats["rescored"] = rescored
 
-        #calculate position sepecific scoring matrices and regexes for each enzyme
-        pssms, regexs, code_to_name = analyze_enzymes(filtered_enzyme_df, self._background)
+    @property
+    def memo_stats(self):
+        return {"mapping": self._mapping_memo.stats(), "matching": self._match_memo.stats()}
 
-        # build Trie based on regexes
-        trie = RegexTrie(alphabet)
-        for code in regexs:
-            regex = regexs[code]
-            trie.insert(regex, code)
-        
-        #match enzymes for each cleavage
-        self._result = match_enzymes(self._peptide_df, trie, pssms, code_to_name, self._background)
-        self._calculated = True
+    @property
+    def stage_stats(self):
+        '''Number of times each stage was computed.'''
+        return self._stages.stats()
+
+    def get_results(self, proteinID, metadata_filter):
+        # every stage feeds the matches, so they are stale as soon as anything changed
+        if self._stages.is_stale("matches"):
+            self.calculate()
+        return accumulate_results(self._result, proteinID, metadata_filter, self.assignment)
 
-    def search_species(self, input):
-        return search_function(input, self.possible_species)
+    def calculate(self):
+        '''Recompute the stale stages, stages whose inputs did not change are reused.'''
+        stages = {
+            "index": self._build_index,
+            "windows": self._map_peptides,
+            "model": self._compile_model,
+            "matches": self._match,
+        }
+        for stage in self._stages.pending():
+            if stage in stages:
+                stages[stage]()
+            self._stages.done(stage)
+
+    def search_species(self, input, limit=None, offset=0):
+        return self._species_index.search(input, limit, offset)
     
-    def search_enzymes(self, input):
-        return search_function(input, self.possible_enzymes)
+    def search_enzymes(self, input, limit=None, offset=0):
+        return self._enzyme_index.search(input, limit, offset)
 
 
 
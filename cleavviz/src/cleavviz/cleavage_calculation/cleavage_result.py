@@ -0,0 +1,230 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from .helper import decode_windows
+
+ASSIGNMENTS = ("best", "fractional")
+
+def csr_take(offsets, rows):
+    '''
+    Select rows of a compressed sparse row layout.
+
+    args:
+        offsets: The values of row i are values[offsets[i]:offsets[i + 1]].
+        rows: Row indices.
+
+    returns:
+        new_offsets: Offsets of the selected rows.
+        flat: Indices into values of the values of the selected rows.
+    '''
+
+    counts = np.diff(offsets)[rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(counts)
+    flat = np.repeat(offsets[rows] - new_offsets[:-1], counts) + np.arange(new_offsets[-1])
+    return new_offsets, flat
+
+
+@dataclass
+class CleavageResult:
+    '''
+    Matched enzymes of every observed cleavage, stored column by column.
+
+    As returned by match_enzymes, row 2i is the n-terminal and row 2i + 1 the c-terminal cleavage of peptide i.
+
+    windows: (n, 8) uint8 amino acid indices of the residues P4 to P4'.
+    proteins: Categorical protein id of each cleavage, NaN for unmapped peptides.
+    enzymes: Categorical name of the best matching enzyme.
+    positions: int64 0-based position of the cleavage in its protein, -1 for unmapped peptides.
+    p_values, log_p_values: p-value of each best match and its natural logarithm, NaN if no enzyme matches.
+    sample_names: Names of all samples.
+    sample_offsets, sample_ids: The samples of cleavage i are sample_ids[sample_offsets[i]:sample_offsets[i + 1]].
+    candidate_offsets: The ranked candidate enzymes of cleavage i are candidate_offsets[i]:candidate_offsets[i + 1]
+                       of candidate_enzymes, candidate_scores and candidate_log_p_values. candidate_enzymes
+                       has the categories of enzymes.
+    protein_offsets: Only set if the rows are sorted by protein, see sort_by_protein. The cleavages of
+                     protein category i are the rows protein_offsets[i]:protein_offsets[i + 1].
+    '''
+
+    windows: np.ndarray
+    proteins: pd.Categorical
+    enzymes: pd.Categorical
+    positions: np.ndarray
+    p_values: np.ndarray
+    log_p_values: np.ndarray
+    sample_names: list
+    sample_offsets: np.ndarray
+    sample_ids: np.ndarray
+    candidate_offsets: np.ndarray
+    candidate_enzymes: pd.Categorical
+    candidate_scores: np.ndarray
+    candidate_log_p_values: np.ndarray
+    protein_offsets: np.ndarray = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def sample_counts(self):
+        '''Number of samples of each cleavage.'''
+        return np.diff(self.sample_offsets)
+
+    @property
+    def candidate_counts(self):
+        '''Number of candidate enzymes of each cleavage.'''
+        return np.diff(self.candidate_offsets)
+
+    def take(self, rows):
+        '''
+        args:
+            rows: Row indices or boolean mask.
+
+        returns:
+            CleavageResult with the selected rows.
+        '''
+
+        rows = np.arange(*rows.indices(len(self))) if isinstance(rows, slice) else np.arange(len(self))[rows]
+        sample_offsets, samples = csr_take(self.sample_offsets, rows)
+        candidate_offsets, candidates = csr_take(self.candidate_offsets, rows)
+
+        return CleavageResult(
+            self.windows[rows],
+            self.proteins[rows],
+            self.enzymes[rows],
+            self.positions[rows],
+            self.p_values[rows],
+            self.log_p_values[rows],
+            self.sample_names,
+            sample_offsets,
+            self.sample_ids[samples],
+            candidate_offsets,
+            self.candidate_enzymes[candidates],
+            self.candidate_scores[candidates],
+            self.candidate_log_p_values[candidates],
+        )
+
+    def sort_by_protein(self):
+        '''
+        returns:
+            CleavageResult with the rows sorted by protein and its protein_offsets, unmapped cleavages
+            come last. The order of the cleavages of a protein is kept.
+        '''
+
+        codes = self.proteins.codes.astype(np.int64)
+        codes[codes < 0] = len(self.proteins.categories)
+        order = np.argsort(codes, kind="stable")
+
+        result = self.take(order)
+        result.protein_offsets = np.searchsorted(codes[order], np.arange(len(self.proteins.categories) + 1))
+        return result
+
+    def protein_rows(self, protein_id):
+        '''
+        Rows of the cleavages of a protein, a slice if the rows are sorted by protein.
+
+        args:
+            protein_id: String.
+
+        returns:
+            slice or boolean mask over the rows.
+        '''
+
+        protein = self.proteins.categories.get_indexer([protein_id])[0]
+        if self.protein_offsets is None:
+            return (self.proteins.codes == protein) & (protein >= 0)
+        if protein < 0:
+            return slice(0, 0)
+        return slice(int(self.protein_offsets[protein]), int(self.protein_offsets[protein + 1]))
+
+    def in_samples(self, names):
+        '''True for the cleavages observed in any of the given samples.'''
+
+        names = set(names)
+        ids = [i for i, name in enumerate(self.sample_names) if name in names]
+        hits = np.isin(self.sample_ids, ids)
+        rows = np.repeat(np.arange(len(self)), self.sample_counts)
+        return np.bincount(rows[hits], minlength=len(self)) > 0
+
+    def candidate_weights(self):
+        '''
+        Fractional assignment of each cleavage to its candidates.
+
+        The scores are log2-odds, so candidate j of a cleavage gets the weight 2^s_j / sum_i 2^s_i.
+        '''
+
+        counts = self.candidate_counts
+        if len(self.candidate_scores) == 0:
+            return np.zeros(0)
+
+        cleavages = np.repeat(np.arange(len(self)), counts)
+        first = self.candidate_offsets[:-1][counts > 0]
+        maxima = np.maximum.reduceat(self.candidate_scores, first)
+        weights = np.exp2(self.candidate_scores - np.repeat(maxima, counts[counts > 0]))
+        return weights / np.bincount(cleavages, weights=weights)[cleavages]
+
+    def assignments(self, assignment="best"):
+        '''
+        Assign the cleavages to enzymes.
+
+        args:
+            assignment: "best" to assign each cleavage to its best enzyme, "fractional" to split it between
+                        its candidates by candidate_weights. Cleavages without candidates keep their enzyme.
+
+        returns:
+            rows: Cleavage of each assignment.
+            enzymes: Category code of the enzyme of each assignment.
+            weights: Weight of each assignment.
+            p_values: p-value of the enzyme of each assignment.
+        '''
+
+        if assignment not in ASSIGNMENTS:
+            raise ValueError(f"Unknown assignment {assignment}, use one of {ASSIGNMENTS}.")
+
+        if assignment == "best":
+            return np.arange(len(self)), self.enzymes.codes, np.ones(len(self)), self.p_values
+
+        counts = self.candidate_counts
+        unassigned = np.flatnonzero(counts == 0)
+        rows = np.concatenate([np.repeat(np.arange(len(self)), counts), unassigned])
+        enzymes = np.concatenate([self.candidate_enzymes.codes, self.enzymes.codes[unassigned]])
+        weights = np.concatenate([self.candidate_weights(), np.ones(len(unassigned))])
+        p_values = np.concatenate([np.exp(self.candidate_log_p_values), self.p_values[unassigned]])
+        return rows, enzymes, weights, p_values
+
+    def candidate_table(self):
+        '''
+        returns:
+            Pandas dataframe with one row per candidate enzyme of each cleavage and the columns cleavage,
+            rank, enzyme, score, p_value and log_p_value.
+        '''
+
+        counts = self.candidate_counts
+        return pd.DataFrame({
+            "cleavage": np.repeat(np.arange(len(self)), counts),
+            "rank": np.arange(len(self.candidate_scores)) - np.repeat(self.candidate_offsets[:-1], counts),
+            "enzyme": np.asarray(self.candidate_enzymes, dtype=object),
+            "score": self.candidate_scores,
+            "p_value": np.exp(self.candidate_log_p_values),
+            "log_p_value": self.candidate_log_p_values,
+        })
+
+    def to_dataframe(self):
+        '''
+        returns:
+            Pandas dataframe with one row per cleavage and the columns cleavage_site, proteinID, enzyme,
+            position, p_value, log_p_value and sample, the list of sample names. position is a
+            nullable Int64 column, missing for unmapped peptides.
+        '''
+
+        names = np.array(self.sample_names, dtype=object)
+        samples = np.split(names[self.sample_ids], self.sample_offsets[1:-1]) if len(self) else []
+
+        return pd.DataFrame({
+            "cleavage_site": decode_windows(self.windows).astype(object),
+            "proteinID": np.asarray(self.proteins, dtype=object),
+            "enzyme": np.asarray(self.enzymes, dtype=object),
+            "position": pd.arrays.IntegerArray(self.positions.astype(np.int64), self.positions < 0),
+            "p_value": self.p_values,
+            "log_p_value": self.log_p_values,
+            "sample": [sample.tolist() for sample in samples],
+        })
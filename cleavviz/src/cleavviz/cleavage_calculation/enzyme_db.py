@@ -0,0 +1,196 @@
+'''
+Precompiled enzyme database.
+
+The enzyme motifs are compiled from enzyme_motifs.parquet into a directory of .npy files that
+ships with the package:
+
+    counts.npy    int32 [n_enzymes, 8, 20] observed amino acids at the sites P4 to P4'
+    codes.npy     MEROPS code of each enzyme
+    names.npy     name of each enzyme, "" if unknown
+    species.npy   species of each enzyme, "" if unknown
+
+The /P variants of the standard enzymes are materialised as rows of their own. Rebuild the
+database after changing the parquet file or the standard enzymes with
+
+    python -m cleavviz.cleavage_calculation.enzyme_db
+'''
+
+import functools
+from functools import cached_property
+import importlib.resources
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .constants import amino_acids, site_columns, base_enzyme_codes, base_enzymes
+from .motifs import calculate_log_frequencies
+
+ENZYME_DB_DIRECTORY = "enzyme_db"
+SOURCE_FILE = "enzyme_motifs.parquet"
+
+@dataclass
+class EnzymeDB:
+    '''
+    Observed cleavage sites of all enzymes.
+
+    counts[i, s, a] is the number of cleavages of enzyme i with amino acid a at site s.
+    '''
+
+    counts: np.ndarray
+    codes: np.ndarray
+    names: np.ndarray
+    species: np.ndarray
+
+    def __len__(self):
+        return len(self.codes)
+
+    @cached_property
+    def selector(self):
+        '''Bitsets to select enzymes by species, name and the standard enzymes, see EnzymeSelector.'''
+        return EnzymeSelector(self.codes.tolist(), self.names.tolist(), self.species.tolist())
+
+    @cached_property
+    def log_frequencies(self):
+        '''
+        Background independent part of the scoring matrices of all enzymes, [n_enzymes, 8, 20].
+
+        Computed once per process, the log-odds against a proteome are applied with motifs.apply_background.
+        '''
+
+        return calculate_log_frequencies(self.counts)
+
+    def to_dataframe(self):
+        '''
+        returns:
+            Pandas dataframe with the columns code, enzyme_name, species and one column Site_<site>_<aa>
+            for every site and amino acid. Row i describes enzyme i.
+        '''
+
+        columns = [f"{site}_{aa}" for site in site_columns for aa in amino_acids]
+        enzyme_df = pd.DataFrame(np.asarray(self.counts).reshape(len(self), -1), columns=columns)
+        enzyme_df.insert(0, "code", self.codes.tolist())
+        enzyme_df.insert(1, "enzyme_name", [name or None for name in self.names.tolist()])
+        enzyme_df.insert(2, "species", [species or None for species in self.species.tolist()])
+        return enzyme_df
+
+
+class EnzymeSelector:
+    '''
+    Precomputed bitsets over the rows of the enzyme database.
+
+    Every species, every enzyme name and the standard enzymes get a bitset with bit i set for the
+    enzymes in row i, so a selection is a few bitwise ORs over 64 bit words.
+    '''
+
+    def __init__(self, codes, names, species):
+        self.n_enzymes = len(codes)
+        self.standard = self._bitset(np.isin(np.asarray(codes, dtype=str), list(base_enzyme_codes)))
+        self.by_name = self._bitsets(names)
+        self.by_species = self._bitsets(species)
+
+    def _bitset(self, mask):
+        n_bytes = -(-self.n_enzymes // 64) * 8
+        bits = np.zeros(n_bytes, dtype=np.uint8)
+        packed = np.packbits(mask, bitorder="little")
+        bits[:len(packed)] = packed
+        return bits.view(np.uint64)
+
+    def _bitsets(self, values):
+        rows = defaultdict(list)
+        for i, value in enumerate(values):
+            if value:
+                rows[value].append(i)
+
+        bitsets = {}
+        for value, indices in rows.items():
+            mask = np.zeros(self.n_enzymes, dtype=bool)
+            mask[indices] = True
+            bitsets[value] = self._bitset(mask)
+        return bitsets
+
+    def select(self, use_standard_enzymes, species, enzymes):
+        '''
+        Rows of the enzymes matching any of the criteria.
+
+        args:
+            use_standard_enzymes: Whether to include the standard enzymes.
+            species: Species or list of species, None for no species.
+            enzymes: List of enzyme names, None for no enzymes.
+
+        returns:
+            np.ndarray: Sorted row indices of the selected enzymes, all rows if no criterion is given.
+        '''
+
+        if isinstance(species, str):
+            species = [species]
+
+        if not species and not enzymes and not use_standard_enzymes:
+            return np.arange(self.n_enzymes)
+
+        bits = np.zeros_like(self.standard)
+        if use_standard_enzymes:
+            bits |= self.standard
+        for value in species or []:
+            if value in self.by_species:
+                bits |= self.by_species[value]
+        for value in enzymes or []:
+            if value in self.by_name:
+                bits |= self.by_name[value]
+
+        return np.flatnonzero(np.unpackbits(bits.view(np.uint8), count=self.n_enzymes, bitorder="little"))
+
+
+def build_enzyme_db(source, directory):
+    '''
+    Compile the enzyme motifs of a parquet file into the enzyme database.
+
+    args:
+        source: Path of the parquet file with one row per enzyme.
+        directory: Directory the .npy files are written to.
+    '''
+
+    enzyme_df = pd.read_parquet(source, engine="pyarrow")
+
+    # the /P variants share the counts of their base enzyme, the standard enzymes get their common name
+    rows = [enzyme_df]
+    for code in base_enzyme_codes:
+        if code[-2:] == "/P":
+            row = enzyme_df[enzyme_df["code"] == code[:-2]].iloc[[0]].copy()
+            row["enzyme_name"] = base_enzymes[code]["name"]
+            row["code"] = code
+            rows.append(row)
+        else:
+            enzyme_df.loc[enzyme_df["code"] == code, "enzyme_name"] = base_enzymes[code]["name"]
+    enzyme_df = pd.concat(rows, ignore_index=True)
+
+    columns = [f"{site}_{aa}" for site in site_columns for aa in amino_acids]
+    counts = enzyme_df.reindex(columns=columns).fillna(0).to_numpy(dtype=np.int32)
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    np.save(directory / "counts.npy", counts.reshape(len(enzyme_df), len(site_columns), len(amino_acids)))
+    for name, column in (("codes", "code"), ("names", "enzyme_name"), ("species", "species")):
+        np.save(directory / f"{name}.npy", np.array(enzyme_df[column].fillna("").tolist(), dtype=str))
+
+
+@functools.lru_cache(maxsize=None)
+def load_enzyme_db():
+    '''
+    Load the enzyme database shipped with the package.
+
+    The arrays are memory-mapped and loaded once per process, so all workers share the pages.
+
+    returns:
+        EnzymeDB: Observed cleavage sites of all enzymes.
+    '''
+
+    resources = importlib.resources.files(__package__) / ENZYME_DB_DIRECTORY
+    with importlib.resources.as_file(resources) as directory:
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in ("counts", "codes", "names", "species")}
+    return EnzymeDB(**arrays)
+
+
+if __name__ == "__main__":
+    package = Path(__file__).parent
+    build_enzyme_db(package / SOURCE_FILE, package / ENZYME_DB_DIRECTORY)
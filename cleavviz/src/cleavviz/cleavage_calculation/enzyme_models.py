@@ -0,0 +1,225 @@
+import hashlib
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from functools import cached_property
+import numpy as np
+from .constants import site_columns, alphabet_with_X, base_enzymes, base_enzyme_codes, base_enzyme_codes_without_P
+from .motifs import (get_count_tensor, calculate_log_frequencies, apply_background, background_P1prime,
+                     pssm_to_regex, pssm_to_regex_masks)
+from .candidate_matcher import CandidateMatcher, token_mask
+from .null_distributions import ScoreDistributions, ScoreDistributionCache
+
+DEFAULT_MAX_MODELS = 16
+
+def background_digest(background):
+    '''Content hash of background counts.'''
+    hasher = hashlib.sha256()
+    for aa, count in sorted(background.items()):
+        hasher.update(f"{aa}\t{count}\n".encode())
+    return hasher.hexdigest()
+
+
+@dataclass
+class EnzymeSelection:
+    '''
+    The part of the model of a selection of enzymes that does not depend on the background.
+
+    codes: Enzyme codes in the order of the selection.
+    code_to_name: Dictionary to map enzyme code to their real name.
+    log_frequencies: [n_enzymes, 8, 20] log frequencies, see motifs.calculate_log_frequencies.
+    without_P: Boolean mask of the /P variants, their P1' follows the background.
+    is_base: Boolean mask of the base enzymes, they have fixed regex patterns.
+    base_masks: [n_base, 8, 21] amino acid masks of the regex patterns of the base enzymes.
+    base_wildcard: [n_base, 8] True for the sites of the base enzymes with the pattern ["X"].
+    '''
+
+    codes: list
+    code_to_name: dict
+    log_frequencies: np.ndarray
+    without_P: np.ndarray
+    is_base: np.ndarray
+    base_masks: np.ndarray
+    base_wildcard: np.ndarray
+
+    @classmethod
+    def from_enzymes(cls, enzyme_df, log_frequencies=None):
+        '''
+        args:
+            enzyme_df: Pandas dataframe containing the selected enzymes along with their observed cleavages.
+            log_frequencies: Precomputed log frequencies of the selected enzymes, computed from enzyme_df if None.
+
+        returns:
+            EnzymeSelection
+        '''
+
+        codes = enzyme_df["code"].tolist()
+        code_to_name = defaultdict(str, zip(codes, enzyme_df["enzyme_name"]))
+        if log_frequencies is None:
+            log_frequencies = calculate_log_frequencies(get_count_tensor(enzyme_df))
+
+        is_base = np.array([code in base_enzyme_codes for code in codes], dtype=bool)
+        without_P = np.array([code in base_enzyme_codes_without_P for code in codes], dtype=bool)
+        base_regexes = [base_enzymes[code]["regex"] for code, base in zip(codes, is_base) if base]
+        base_masks = np.array([[token_mask(token_list) for token_list in regex] for regex in base_regexes], dtype=bool)
+        base_wildcard = np.array([[token_list == ["X"] for token_list in regex] for regex in base_regexes], dtype=bool)
+
+        return cls(codes, code_to_name, np.asarray(log_frequencies), without_P, is_base,
+                   base_masks.reshape(-1, len(site_columns), len(alphabet_with_X)), base_wildcard.reshape(-1, len(site_columns)))
+
+
+@dataclass
+class EnzymeModel:
+    '''
+    Everything needed to match cleavages against a selection of enzymes.
+
+    pssms: Position specific scoring matrix of each enzyme code.
+    code_to_name: Dictionary to map enzyme code to their real name.
+    matcher: Bit-parallel matcher of the regex patterns of all enzymes.
+    null: Score distributions of the enzymes of the matcher under the background.
+    key: Enzyme codes and background digest the model was compiled for.
+    '''
+
+    pssms: dict
+    code_to_name: dict
+    matcher: CandidateMatcher
+    null: ScoreDistributions
+    key: tuple = None
+
+    @cached_property
+    def regexes(self):
+        '''Regex pattern of each enzyme code, see motifs.pssm_to_regex.'''
+        return pssm_to_regex(self.pssms)
+
+    @classmethod
+    def from_enzymes(cls, enzyme_df, background, key=None, log_frequencies=None):
+        '''
+        Compile the model of a selection of enzymes.
+
+        args:
+            enzyme_df: Pandas dataframe containing the selected enzymes along with their observed cleavages.
+            background: Dictionary with the total count of each amino acid.
+            key: Key identifying the model, see EnzymeModelCache.
+            log_frequencies: Precomputed log frequencies of the selected enzymes, see motifs.calculate_log_frequencies.
+
+        returns:
+            EnzymeModel
+        '''
+
+        return cls.from_selection(EnzymeSelection.from_enzymes(enzyme_df, log_frequencies), background, key)
+
+    @classmethod
+    def from_selection(cls, selection, background, key=None, nulls=None):
+        '''
+        Apply a background to a selection of enzymes.
+
+        The PSSMs, regex patterns and matcher are computed for all enzymes at once, the exact score
+        distributions are the only part that takes noticeable time. They are taken from nulls for
+        the enzymes it already holds.
+
+        args:
+            selection: EnzymeSelection.
+            background: Dictionary with the total count of each amino acid.
+            key: Key identifying the model, see EnzymeModelCache.
+            nulls: ScoreDistributionCache, the distributions are computed for all enzymes if None.
+
+        returns:
+            EnzymeModel
+        '''
+
+        log_frequencies = background_P1prime(selection.log_frequencies, selection.without_P, background)
+        pssm_tensor = apply_background(log_frequencies, background)
+
+        # regex patterns are enriched amino acids, so they depend on the background as well
+        masks, wildcard = pssm_to_regex_masks(pssm_tensor)
+        masks[selection.is_base] = selection.base_masks
+        wildcard[selection.is_base] = selection.base_wildcard
+        # patterns that allow anything at every site are left out, like in CandidateMatcher
+        keep = ~wildcard.all(axis=1)
+
+        codes = np.asarray(selection.codes, dtype=object)[keep].tolist()
+        matcher = CandidateMatcher.from_masks(codes, masks[keep])
+        if nulls is None:
+            null = ScoreDistributions.from_pssms(pssm_tensor[keep], background)
+        else:
+            null = nulls.get(codes, pssm_tensor[keep], background, background_digest(background))
+
+        return cls(dict(zip(selection.codes, pssm_tensor)), selection.code_to_name, matcher, null, key)
+
+
+class EnzymeModelCache:
+    '''
+    Least recently used cache of compiled enzyme models.
+
+    Models are keyed by the set of enzyme codes and the digest of the background, so switching
+    back to a recent enzyme selection does not compile its model again. The background independent
+    EnzymeSelection is cached by the enzyme codes alone, so a new background, e.g. of a new fasta
+    file, only applies the background to it. The score distributions are cached per enzyme, so a
+    changed selection only computes those of the newly selected enzymes.
+
+    If the log frequencies of the whole enzyme database are given, the rows of a selection are taken
+    by the index of its dataframe and only the background is applied when a model is compiled.
+    '''
+
+    def __init__(self, log_frequencies=None, max_models=DEFAULT_MAX_MODELS):
+        self.log_frequencies = log_frequencies
+        self.max_models = max_models
+        self.models = OrderedDict()
+        self.selections = OrderedDict()
+        self.nulls = ScoreDistributionCache()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, enzyme_df, background):
+        '''
+        Look up the model of an enzyme selection, compile it if it is not cached.
+
+        args:
+            enzyme_df: Pandas dataframe containing the selected enzymes along with their observed cleavages.
+            background: Dictionary with the total count of each amino acid.
+
+        returns:
+            EnzymeModel
+        '''
+
+        key = (frozenset(enzyme_df["code"]), background_digest(background))
+
+        if key in self.models:
+            self.hits += 1
+            self.models.move_to_end(key)
+            return self.models[key]
+
+        self.misses += 1
+        model = EnzymeModel.from_selection(self.get_selection(enzyme_df), background, key, self.nulls)
+        self.models[key] = model
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+        return model
+
+    def get_selection(self, enzyme_df):
+        '''
+        Look up the background independent part of the model of an enzyme selection.
+
+        args:
+            enzyme_df: Pandas dataframe containing the selected enzymes along with their observed cleavages.
+
+        returns:
+            EnzymeSelection
+        '''
+
+        key = frozenset(enzyme_df["code"])
+
+        if key in self.selections:
+            self.selections.move_to_end(key)
+            return self.selections[key]
+
+        log_frequencies = None
+        if self.log_frequencies is not None:
+            log_frequencies = self.log_frequencies[enzyme_df.index.to_numpy()]
+        selection = EnzymeSelection.from_enzymes(enzyme_df, log_frequencies)
+        self.selections[key] = selection
+        while len(self.selections) > self.max_models:
+            self.selections.popitem(last=False)
+        return selection
+
+    def __len__(self):
+        return len(self.models)
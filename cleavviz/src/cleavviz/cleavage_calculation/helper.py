@@ -1,10 +1,49 @@
+import numpy as np
 import pandas as pd
-from .constants import three_to_one
+from .constants import three_to_one, aa_to_idx, alphabet_with_X
 
-def search_function(input: str, list: list):
-    if input == None:
-        return list
-    return [item for item in list if input in str(item)]
+# maps every byte to its amino acid index, everything unknown is encoded as X
+aa_lookup = np.full(256, aa_to_idx["X"], dtype=np.uint8)
+for aa, idx in aa_to_idx.items():
+    aa_lookup[ord(aa)] = idx
+
+# maps amino acid indices back to their letters
+alphabet_bytes = np.frombuffer(alphabet_with_X.encode("ascii"), dtype=np.uint8)
+
+def encode_sequence(sequence: str):
+    '''
+    Encode a sequence into an array of amino acid indices.
+
+    args:
+        sequence: String of amino acids.
+
+    returns:
+        np.ndarray: uint8 array with the index of each amino acid, unknown residues are encoded as X.
+    '''
+
+    return aa_lookup[np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)]
+
+def decode_windows(windows):
+    '''
+    Convert encoded windows back into strings.
+
+    args:
+        windows: (n, k) array of amino acid indices.
+
+    returns:
+        np.ndarray: n strings of length k.
+    '''
+
+    letters = np.ascontiguousarray(alphabet_bytes[windows], dtype=np.uint8)
+    return letters.view(f"S{letters.shape[1]}").ravel().astype(str)
+
+def pack_windows(windows):
+    '''View (n, 8) uint8 windows as n uint64 values, so they fit into one dataframe column.'''
+    return np.ascontiguousarray(windows, dtype=np.uint8).view(np.uint64).ravel()
+
+def unpack_windows(packed):
+    '''Inverse of pack_windows.'''
+    return np.ascontiguousarray(packed, dtype=np.uint64).view(np.uint8).reshape(-1, 8)
 
 def convert_3to1(aa3: str):
     if aa3 is None:
@@ -12,13 +51,6 @@ def convert_3to1(aa3: str):
     aa3 = aa3.capitalize()
     return three_to_one.get(aa3, "X")
 
-def normalize_background(bg_counts: dict):
-    total = sum(bg_counts.values())
-    if total == 0:
-        raise ValueError("Background counts sum to 0")
-    bg_probs = {aa: count / total for aa, count in bg_counts.items()}
-    return bg_probs
-
 def counts_to_relative_motif(counts):
     '''
     Transform absolute counts of each amino acid for each position into a relative motif
@@ -27,10 +59,12 @@ def counts_to_relative_motif(counts):
         counts: Array of a dict containing absolute counts for each amino acid for a position
 
     returns:
-        pd.Dataframe: Pandas dataframe with the relative frequency of each amino acid per site
+        pd.Dataframe: Pandas dataframe with the relative frequency of each amino acid per site,
+                      the columns follow alphabet_with_X
     '''
 
-    all_aas = set().union(*[d.keys() for d in counts])
+    order = {aa: i for i, aa in enumerate(alphabet_with_X)}
+    all_aas = sorted(set().union(*[d.keys() for d in counts]), key=lambda aa: (order.get(aa, len(order)), aa))
     rows = []
 
     for position in counts:
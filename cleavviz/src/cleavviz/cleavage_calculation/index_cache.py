@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+from .proteome import Proteome
+from .mapping import get_peptide_index_class
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "cleavviz" / "indexes"
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+
+def fasta_digest(fasta):
+    '''
+    Content hash of a fasta dataframe.
+
+    args:
+        fasta: Fasta file containing protein id's and sequences.
+
+    returns:
+        Hex digest identifying the ids and sequences of the fasta file.
+    '''
+
+    hasher = hashlib.sha256(f"cleavviz-index-v{CACHE_VERSION}\n".encode())
+    for id, sequence in zip(fasta["id"], fasta["sequence"]):
+        hasher.update(f"{id}\t{sequence}\n".encode("utf-8", errors="replace"))
+    return hasher.hexdigest()
+
+
+class IndexCache:
+    '''
+    Content addressed on-disk cache of proteomes, peptide indexes and background counts.
+
+    Every fasta file gets one directory named after its digest. The arrays are stored as .npy
+    files and loaded memory-mapped, so attaching a cached proteome does not read the index
+    into memory. Directories are evicted least recently used first once the cache grows
+    beyond max_bytes.
+
+    The location and budget default to the environment variables CLEAVVIZ_CACHE_DIR and
+    CLEAVVIZ_CACHE_MAX_BYTES.
+    '''
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = os.environ.get("CLEAVVIZ_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("CLEAVVIZ_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def load(self, digest, method):
+        '''
+        Attach a cached proteome.
+
+        args:
+            digest: Digest of the fasta file, see fasta_digest.
+            method: Mapping method of the peptide index.
+
+        returns:
+            (proteome, peptide_index, background) or None if the entry is not cached.
+        '''
+
+        entry = self.directory / digest
+        index_dir = entry / method
+        if not index_dir.is_dir():
+            return None
+
+        try:
+            proteome = Proteome(
+                json.loads((entry / "ids.json").read_text()),
+                self._load(entry / "sequence.npy").tobytes().decode("ascii"),
+                self._load(entry / "offsets.npy"),
+                self._load(entry / "lengths.npy"),
+                self._load(entry / "encoded.npy"),
+            )
+            background = json.loads((entry / "background.json").read_text())
+            arrays = {path.stem: self._load(path) for path in index_dir.glob("*.npy")}
+            peptide_index = get_peptide_index_class(method).from_arrays(arrays, proteome)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Discarding unreadable index cache entry {digest}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        # mark as recently used
+        os.utime(entry)
+        return proteome, peptide_index, background
+
+    def store(self, digest, method, proteome, peptide_index, background):
+        '''
+        Store a proteome together with its peptide index and background counts.
+
+        args:
+            digest: Digest of the fasta file, see fasta_digest.
+            method: Mapping method of the peptide index.
+            proteome: Concatenated and encoded protein sequences.
+            peptide_index: Index built for the proteome.
+            background: Dictionary with the total count of each amino acid.
+        '''
+
+        if self.max_bytes <= 0:
+            return
+
+        entry = self.directory / digest
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            if not entry.is_dir():
+                staging = Path(tempfile.mkdtemp(prefix=f".{digest}-", dir=self.directory))
+                np.save(staging / "sequence.npy", proteome.text)
+                np.save(staging / "offsets.npy", proteome.offsets)
+                np.save(staging / "lengths.npy", proteome.lengths)
+                np.save(staging / "encoded.npy", proteome.encoded)
+                (staging / "ids.json").write_text(json.dumps(list(proteome.ids)))
+                (staging / "background.json").write_text(json.dumps(dict(background)))
+                self._publish(staging, entry)
+
+            if not (entry / method).is_dir():
+                staging = Path(tempfile.mkdtemp(prefix=f".{method}-", dir=entry))
+                for name, array in peptide_index.to_arrays().items():
+                    np.save(staging / f"{name}.npy", array)
+                self._publish(staging, entry / method)
+
+            os.utime(entry)
+            self.evict()
+        except OSError as e:
+            logger.warning(f"Could not write index cache entry {digest}: {e}")
+
+    def evict(self):
+        '''Remove least recently used entries until the cache fits into max_bytes.'''
+
+        entries = [path for path in self.directory.iterdir() if path.is_dir() and not path.name.startswith(".")]
+        sizes = {entry: self._size(entry) for entry in entries}
+        total = sum(sizes.values())
+
+        for entry in sorted(entries, key=lambda path: path.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+
+    @staticmethod
+    def _load(path):
+        return np.load(path, mmap_mode="r")
+
+    @staticmethod
+    def _size(directory):
+        return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+    @staticmethod
+    def _publish(staging, target):
+        '''Move a completely written directory into place, another worker may have been faster.'''
+        try:
+            staging.rename(target)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
@@ -1,32 +1,240 @@
 from collections import defaultdict
-from .constants import amino_acids
+import numpy as np
+from .constants import amino_acids, aa_to_idx
+from .helper import encode_sequence
+from .proteome import SEPARATOR, HitTable
+from .sharding import protein_shards, map_shards, merge_sorted_shards
 
-def build_kmer_index_and_background(fasta, k=6):
+BITS_PER_RESIDUE = 5
+
+def pack_kmers(encoded, k):
     '''
-    Build a kmer index while also counting aminoacids to provide a background count of each amino acid.
+    Pack every k-mer of an encoded sequence into a single integer.
 
     args:
-        fasta: Fasta file containing protein id's and sequences.
+        encoded: uint8 array of amino acid indices.
+        k: Number determining the length of the k-mers.
+
+    returns:
+        np.ndarray: int64 array where entry i holds the k-mer starting at position i.
+    '''
+
+    n = len(encoded) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    keys = np.zeros(n, dtype=np.int64)
+    for j in range(k):
+        keys <<= BITS_PER_RESIDUE
+        keys |= encoded[j:j + n]
+    return keys
+
+
+def _sorted_kmers(encoded, offsets, lengths, first_protein, k):
+    '''
+    Pack and sort the k-mers of a shard of proteins.
+
+    args:
+        encoded: Encoded sequence of the shard.
+        offsets: Start of each protein within the shard.
+        lengths: Length of each protein.
+        first_protein: Index of the first protein of the shard in the proteome.
+        k: Number determining the length of the k-mers.
+
+    returns:
+        Sorted k-mers with the protein and position of each k-mer.
+    '''
+
+    # start positions of all k-mers that do not cross a protein boundary
+    counts = np.maximum(lengths - k + 1, 0)
+    protein_of_kmer = np.repeat(np.arange(len(lengths), dtype=np.int32), counts)
+    first_kmer = np.cumsum(counts) - counts
+    local_positions = np.arange(counts.sum(), dtype=np.int64) - np.repeat(first_kmer, counts)
+
+    keys = pack_kmers(encoded, k)[offsets[protein_of_kmer] + local_positions]
+
+    # stable sort keeps the hits of every k-mer ordered by protein and position
+    order = np.argsort(keys, kind="stable")
+    return keys[order], protein_of_kmer[order] + np.int32(first_protein), local_positions[order].astype(np.int32)
+
+
+class KmerIndex:
+    '''
+    Compact k-mer index over a proteome.
+
+    Every k-mer is packed into an integer. The hits are stored in CSR layout: the hits of
+    kmers[i] are proteins[indptr[i]:indptr[i+1]] and positions[indptr[i]:indptr[i+1]],
+    ordered by protein and position like the dictionary index they replace.
+
+    Residues outside the 20 standard amino acids, including lowercase letters, are all packed
+    like X. Hits of k-mers containing such residues are therefore checked against the proteome
+    sequence, so lookups only return exact occurrences.
+    '''
+
+    def __init__(self, k, proteome, kmers, indptr, proteins, positions):
+        self.k = k
+        self.proteome = proteome
+        self.ids = proteome.ids
+        self.kmers = kmers
+        self.indptr = indptr
+        self.proteins = proteins
+        self.positions = positions
+
+    @classmethod
+    def from_proteome(cls, proteome, k=6, n_workers=1):
+        '''
+        Build the index for all k-mers of a proteome.
+
+        Large proteomes are split into shards of whole proteins, the shards are indexed in parallel
+        worker processes and the sorted partial indexes are merged.
+
+        args:
+            proteome: Concatenated and encoded protein sequences.
+            k: Number determining the length of the k-mers.
+            n_workers: Number of worker processes, None for CLEAVVIZ_MAX_WORKERS, see sharding.resolve_workers.
+
+        returns:
+            KmerIndex: Index over all k-mers that lie completely inside one protein.
+        '''
+
+        shards = []
+        for first, stop in protein_shards(proteome, n_workers):
+            # the only shard of an empty proteome is empty
+            start = proteome.offsets[first] if stop > first else 0
+            end = proteome.offsets[stop - 1] + proteome.lengths[stop - 1] if stop > first else 0
+            shards.append((proteome.encoded[start:end], proteome.offsets[first:stop] - start, proteome.lengths[first:stop], first, k))
+
+        keys, proteins, positions = merge_sorted_shards(*zip(*map_shards(_sorted_kmers, shards, n_workers)))
+
+        kmers, starts = np.unique(keys, return_index=True)
+        indptr = np.append(starts, len(keys)).astype(np.int64)
+        if k * BITS_PER_RESIDUE <= 32:
+            kmers = kmers.astype(np.uint32)
+
+        return cls(k, proteome, kmers, indptr, proteins, positions)
+
+    def to_arrays(self):
+        '''Arrays needed to restore the index with from_arrays.'''
+        return {
+            "k": np.array(self.k),
+            "kmers": self.kmers,
+            "indptr": self.indptr,
+            "proteins": self.proteins,
+            "positions": self.positions,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, proteome):
+        return cls(
+            int(arrays["k"]),
+            proteome,
+            arrays["kmers"],
+            arrays["indptr"],
+            arrays["proteins"],
+            arrays["positions"],
+        )
+
+    def _lookup(self, kmer):
+        if len(kmer) != self.k:
+            return None
+        key = self.kmers.dtype.type(pack_kmers(encode_sequence(kmer), self.k)[0])
+        i = np.searchsorted(self.kmers, key)
+        if i == len(self.kmers) or self.kmers[i] != key:
+            return None
+        return slice(self.indptr[i], self.indptr[i + 1])
+
+    def get(self, kmer, default=None):
+        '''
+        Look up all occurrences of a k-mer.
+
+        args:
+            kmer: String of length k.
+            default: Value returned if the k-mer does not occur.
+
+        returns:
+            List of (protein id, position) tuples.
+        '''
+
+        hits = self._lookup(kmer)
+        if hits is None:
+            return default
+
+        hits = zip(self.proteins[hits].tolist(), self.positions[hits].tolist())
+        if (encode_sequence(kmer) == aa_to_idx["X"]).any():
+            # all non standard residues share the code of X, keep the exact occurrences only
+            sequence, offsets = self.proteome.sequence, self.proteome.offsets
+            hits = [(p, i) for p, i in hits if sequence.startswith(kmer, offsets[p] + i)]
+        hits = [(self.ids[p], i) for p, i in hits]
+        return hits if hits else default
+
+    def map_peptides(self, sequences, proteome):
+        '''
+        Map every peptide to its first occurrence in the proteome.
+
+        args:
+            sequences: List of unique peptide sequences.
+            proteome: Proteome the index was built from.
+
+        returns:
+            HitTable: At most one row per peptide, peptides shorter than k are not mapped.
+        '''
+
+        peptides, proteins, offsets = [], [], []
+
+        for peptide, sequence in enumerate(sequences):
+            hits = self._lookup(sequence[:self.k])
+            if hits is None:
+                continue
+            for protein, i in zip(self.proteins[hits].tolist(), self.positions[hits].tolist()):
+                start = proteome.offsets[protein] + i
+                if proteome.sequence.startswith(sequence, start):
+                    peptides.append(peptide)
+                    proteins.append(protein)
+                    offsets.append(i)
+                    break
+
+        return HitTable.from_lists(peptides, proteins, offsets)
+
+    def __getitem__(self, kmer):
+        hits = self.get(kmer)
+        if hits is None:
+            raise KeyError(kmer)
+        return hits
+
+    def __contains__(self, kmer):
+        return self.get(kmer) is not None
+
+    def __len__(self):
+        return len(self.kmers)
+
+    @property
+    def nbytes(self):
+        '''Number of bytes held by the index arrays.'''
+        return self.kmers.nbytes + self.indptr.nbytes + self.proteins.nbytes + self.positions.nbytes
+
+
+def count_background(proteome, k=6):
+    '''
+    Count the amino acids of all proteins to provide a background count of each amino acid.
+
+    args:
+        proteome: Concatenated and encoded protein sequences of the fasta file.
         k: Number determining the length of the k-mers.
 
     returns:
-        kmer_index: Dictionary mapping kmers to protein id's.
-        protein_sequences: Dictionary mapping protein id's to protein sequences.
         background: Dictionary with the total count of each amino acid.
     '''
 
-    kmer_index = defaultdict(list)
-    protein_sequences = {}
+    text = proteome.text
+    counts = np.bincount(text, minlength=256)
+    counts[ord(SEPARATOR)] -= len(proteome)
+
+    # the former per k-mer count included the residue k positions before the end of every protein twice
+    long_proteins = proteome.lengths >= k
+    counts += np.bincount(text[proteome.offsets[long_proteins] + proteome.lengths[long_proteins] - k], minlength=256)
+
     background = defaultdict(int, {aa: 1 for aa in amino_acids})
+    for byte in np.flatnonzero(counts).tolist():
+        background[chr(byte)] += int(counts[byte])
 
-    for protein in fasta.itertuples():
-        sequence = protein.sequence
-        protein_sequences[protein.id] = sequence
-        for i in range(len(sequence) - k + 1):
-            kmer = sequence[i:i+k]
-            kmer_index[kmer].append((protein.id, i))
-            background[sequence[i]] += 1
-        for j in sequence[-k:]:
-            background[j] +=1
-
-    return kmer_index, protein_sequences, background
\ No newline at end of file
+    return background
@@ -0,0 +1,32 @@
+from .kmer import KmerIndex
+from .suffix_array import SuffixArray
+from .aho_corasick import AhoCorasickMapper
+
+PEPTIDE_INDEXES = {
+    "kmer": KmerIndex,
+    "suffix_array": SuffixArray,
+    "aho_corasick": AhoCorasickMapper,
+}
+
+MAPPING_METHODS = tuple(PEPTIDE_INDEXES)
+
+def get_peptide_index_class(method):
+    if method not in PEPTIDE_INDEXES:
+        raise ValueError(f"Unknown mapping method: {method}. Use one of {MAPPING_METHODS}.")
+    return PEPTIDE_INDEXES[method]
+
+def build_peptide_index(proteome, method="suffix_array", n_workers=1):
+    '''
+    Build the index used to map peptides onto a proteome.
+
+    args:
+        proteome: Concatenated and encoded protein sequences.
+        method: "kmer" maps every peptide to its first occurrence, "suffix_array" finds all occurrences,
+                "aho_corasick" finds all occurrences with one scan of the proteome per batch of peptides.
+        n_workers: Number of worker processes used to build the index, None for CLEAVVIZ_MAX_WORKERS, see sharding.resolve_workers.
+
+    returns:
+        Index providing map_peptides(sequences, proteome).
+    '''
+
+    return get_peptide_index_class(method).from_proteome(proteome, n_workers=n_workers)
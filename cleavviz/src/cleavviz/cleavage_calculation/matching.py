@@ -1,162 +1,365 @@
+from itertools import chain
 import pandas as pd
 import numpy as np
-import math
-from .constants import alphabet, aa_to_idx, site_columns_index, alphabet_index, alphabet_with_X
-from .helper import normalize_background
-from scipy.stats import norm
-from collections import defaultdict
+from .constants import site_columns_index
+from .helper import unpack_windows
+from .memo import MatchMemo
+from .cleavage_result import CleavageResult, csr_take
+from .candidate_matcher import CandidateMatcher
+from .null_distributions import ScoreDistributions
+from .sharding import resolve_workers, shared_arrays, attach_shared_arrays
+from concurrent.futures import ProcessPoolExecutor
 import time
 
-def match_enzymes(df, trie, pssms, code_to_name, background):
+# bound on the size of the candidate mask of one chunk of windows
+MAX_CHUNK_BYTES = 1 << 26
+
+# windows are only matched in parallel if every worker gets at least this many windows
+MIN_PARALLEL_WINDOWS = 1 << 16
+
+def match_enzymes(df, model, memo=None, n_workers=1, top_k=1):
     '''
     Match enzymes with observed cleavage while also calculating a p_value for each match.
 
+    Identical windows are matched once: the packed windows are uniqued and the results are
+    scattered back with the inverse index.
+
     args:
         df: Pandas dataframe containing all observed cleavages along with their matched protein and metadata.
-        trie: Search tree containing the regex patterns for all candidate enzymes.
-        pssms: Dictionary containing the position specific scoring matrices for all candidate enzymes.
-        code_to_name: Dicionary to map enzyme code to their real name.
-        background: Dictionary with the total count of each amino acid.
+        model: EnzymeModel of all candidate enzymes.
+        memo: MatchMemo with the candidates of windows seen before, only windows missing from the memo
+              are matched. It has to be validated for the model and top_k.
+        n_workers: Number of worker processes used to match the windows, None for CLEAVVIZ_MAX_WORKERS, see sharding.resolve_workers.
+        top_k: Number of candidate enzymes kept per cleavage.
 
     returns:
-        Pandas dataframe containing all information for each cleavage.
+        result: CleavageResult with the matched enzymes of each cleavage.
+        match_stats: Dictionary with the number of windows, unique windows, the deduplication factor
+                     and the time in seconds spent in each stage.
     '''
 
-    cleavage_sites, proteinIDs, enzymes, positions, p_values, samples = [], [], [], [], [], []
-    
+    timings = {}
+    start = time.perf_counter()
+
     df = df.reset_index(drop=True)
 
-    mus, sigmas = precalculate_expected_p_values(pssms, background)
-
-    n_windows = encode_window(df["n_term_cleavage_window"])
-    c_windows = encode_window(df["c_term_cleavage_window"])
-
-    n_codes, n_p_values = find_best_matches(n_windows, trie, pssms, mus, sigmas)
-    c_codes, c_p_values = find_best_matches(c_windows, trie, pssms, mus, sigmas)
-
-    for i, row in df.iterrows():
-
-        if n_codes[i] is not None:
-            cleavage_sites.append(row.n_term_cleavage_window)
-            proteinIDs.append(row.proteinID)
-            enzymes.append(code_to_name.get(n_codes[i], "unspecified cleavage"))
-            positions.append(row.n_term_position)
-            p_values.append(n_p_values[i])
-            samples.append(row.Sample)
-
-        if c_codes[i] is not None:
-            cleavage_sites.append(row.c_term_cleavage_window)
-            proteinIDs.append(row.proteinID)
-            enzymes.append(code_to_name.get(c_codes[i], "unspecified cleavage"))
-            positions.append(row.c_term_position)
-            p_values.append(c_p_values[i])
-            samples.append(row.Sample)
-        
-    result = pd.DataFrame({
-        "cleavage_site": cleavage_sites,
-        "proteinID": proteinIDs,
-        "enzyme": enzymes,
-        "position": positions,
-        "p_value": p_values,
-        "sample": samples
-    })
-
-    return result
-
-def encode_window(series):
-    return series.apply(lambda s: np.array([aa_to_idx.get(a, 20) for a in s], dtype=np.int32)).to_numpy()
-
-
-def find_best_matches(windows, trie, pssms, mus, sigmas):
-    all_codes = []
-    all_pvals = []
-    #start = time.perf_counter()
-    for i, window in enumerate(windows):
-        # if (i % 1000 == 0):
-        #     current = time.perf_counter()
-        #     print(f"time for last 1k cleavages: {current - start:.4f} seconds", "total:", i)
-        #     start = current
-        best_score = float("-inf")
-        best_match = None
-
-        candidates = trie.match("".join(alphabet_with_X[j] for j in window))
-
-        for c in candidates:
-            score = calculate_pssm_score(pssms[c], window)
-            if score > best_score:
-                best_score = score
-                best_match = c
-        if best_match is not None:
-            all_codes.append(best_match)
-            all_pvals.append(calculate_p_value(best_score, window, mus[best_match], sigmas[best_match]))
-        else:
-            all_codes.append("unspecified cleavage")
-            all_pvals.append(None)
-
-    return all_codes, all_pvals
+    # every peptide contributes its n-terminal and then its c-terminal cleavage
+    keys = np.column_stack([df["n_term_cleavage_window"].to_numpy(dtype=np.uint64),
+                            df["c_term_cleavage_window"].to_numpy(dtype=np.uint64)]).ravel()
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    timings["unique"] = time.perf_counter() - start
+
+    # match every window not seen before once, the memo keeps the ranked candidates of each window
+    start = time.perf_counter()
+    memo = MatchMemo() if memo is None else memo
+    missing = memo.missing(unique_keys)
+    rows, codes, scores, log_p_values = find_top_matches(unpack_windows(missing), model.matcher,
+                                                         model.pssms, model.null, top_k, n_workers=n_workers)
+    memo.insert(missing, np.searchsorted(rows, np.arange(len(missing) + 1)), codes, scores, log_p_values)
+    timings["match"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    unique_offsets, enzymes, scores, log_p_values = memo.candidates(unique_keys)
+    memo.evict()
+
+    # the best candidate of each window, enzymes and candidates share their categories
+    names = np.array([model.code_to_name.get(code, "unspecified cleavage") for code in memo.codes] + ["unspecified cleavage"], dtype=object)
+    used = np.unique(np.append(enzymes, len(memo.codes)))
+    category_codes = np.zeros(len(names), dtype=np.int64)
+    categories = pd.Categorical(names[used])
+    category_codes[used] = categories.codes
+    enzymes = category_codes[enzymes]
+
+    has_match = unique_offsets[1:] > unique_offsets[:-1]
+    best = unique_offsets[:-1][has_match]
+    best_enzymes = np.full(len(unique_keys), category_codes[-1])
+    best_enzymes[has_match] = enzymes[best]
+    best_log_p_values = np.full(len(unique_keys), np.nan)
+    best_log_p_values[has_match] = log_p_values[best]
+
+    candidate_offsets, flat = csr_take(unique_offsets, inverse)
+    proteins = pd.Categorical(df["proteinID"])
+
+    # samples of each peptide as integer ids, shared by its two cleavages
+    samples = df["Sample"]
+    sample_offsets = np.zeros(len(samples) + 1, dtype=np.int64)
+    sample_offsets[1:] = np.cumsum(np.fromiter(map(len, samples), dtype=np.int64, count=len(samples)))
+    sample_ids, sample_names = pd.factorize(np.fromiter(chain.from_iterable(samples), dtype=object, count=sample_offsets[-1]))
+    sample_offsets, sample_flat = csr_take(sample_offsets, np.repeat(np.arange(len(samples)), 2))
+
+    # unmapped peptides have no position
+    positions = np.column_stack([df[column].astype("Int64").to_numpy(dtype=np.int64, na_value=-1)
+                                 for column in ("n_term_position", "c_term_position")]).ravel()
+
+    result = CleavageResult(
+        windows=unpack_windows(unique_keys)[inverse],
+        proteins=pd.Categorical.from_codes(np.repeat(proteins.codes, 2), proteins.categories),
+        enzymes=pd.Categorical.from_codes(best_enzymes[inverse], categories.categories),
+        positions=positions,
+        p_values=np.exp(best_log_p_values)[inverse],
+        log_p_values=best_log_p_values[inverse],
+        sample_names=sample_names.tolist(),
+        sample_offsets=sample_offsets,
+        sample_ids=sample_ids[sample_flat].astype(np.int32),
+        candidate_offsets=candidate_offsets,
+        candidate_enzymes=pd.Categorical.from_codes(enzymes[flat], categories.categories),
+        candidate_scores=scores[flat],
+        candidate_log_p_values=log_p_values[flat],
+    )
+    timings["scatter"] = time.perf_counter() - start
+
+    match_stats = {
+        "windows": len(keys),
+        "unique_windows": len(unique_keys),
+        "dedup_factor": len(keys) / len(unique_keys) if len(unique_keys) else 1.0,
+        "matched": len(missing),
+        "timings": timings,
+    }
+
+    return result, match_stats
+
+def carry_over_matches(memo, model, top_k, n_workers=1):
+    '''
+    Carry the memo over to a new enzyme selection instead of matching all windows again.
 
-def calculate_pssm_score(pssm, window):
+    The score and p-value of a match only depend on its enzyme and the background, not on the other
+    enzymes of the selection. So if only the selection changed, the ranked candidates of a window
+    stay valid except for removed enzymes and enzymes added to the selection:
+    Removed enzymes are dropped from complete candidate lists, windows with a full list of top_k
+    candidates that contains a removed enzyme are dropped from the memo and matched again.
+    The remaining windows are only matched against the added enzymes, the windows they match are
+    merged into their candidates.
+
+    args:
+        memo: MatchMemo validated for an earlier model, see match_enzymes.
+        model: EnzymeModel of the new selection.
+        top_k: Number of candidate enzymes kept per cleavage.
+        n_workers: Number of worker processes used to match the windows, None for CLEAVVIZ_MAX_WORKERS, see sharding.resolve_workers.
+
+    returns:
+        int: Number of windows that got new candidates, 0 if the memo could not be carried over.
     '''
-    Calculate the pssm-score for a match.
+
+    key = (model.key, top_k)
+    if memo.key is None or memo.key == key:
+        return 0
+    (old_codes, old_digest), old_top_k = memo.key
+    if old_digest != model.key[1] or old_top_k != top_k:
+        return 0
+
+    removed = old_codes - model.key[0]
+    added = [code for code in model.matcher.codes if code not in old_codes]
+
+    # window of each candidate
+    counts = np.diff(memo.offsets)
+    owner = np.repeat(np.arange(len(memo)), counts)
+    is_removed = np.isin(memo.codes, list(removed))[memo.enzymes]
+    # lower ranked candidates of a full list are unknown
+    kept = ~((np.bincount(owner[is_removed], minlength=len(memo)) > 0) & (counts == top_k))
+    keep = kept[owner] & ~is_removed
+
+    keys = memo.keys[kept]
+    owner = (np.cumsum(kept) - 1)[owner[keep]]
+    codes = memo.codes[memo.enzymes[keep]]
+    scores = memo.scores[keep]
+    log_p_values = memo.log_p_values[keep]
+
+    rescored = 0
+    if added and len(keys):
+        index = pd.Index(model.matcher.codes)
+        enzymes = index.get_indexer(added)
+        matcher = model.matcher.take(enzymes)
+        null = model.null.take(enzymes)
+
+        rows, new_codes, new_scores, new_log_p_values = find_top_matches(unpack_windows(keys), matcher, model.pssms, null, top_k, n_workers=n_workers)
+        owner = np.concatenate([owner, rows])
+        codes = np.concatenate([codes, new_codes])
+        scores = np.concatenate([scores, new_scores])
+        log_p_values = np.concatenate([log_p_values, new_log_p_values])
+
+        # equal scores go to the enzyme first in the new model, as in find_top_matches
+        order = np.lexsort((index.get_indexer(codes), -scores, owner))
+        owner, codes, scores, log_p_values = owner[order], codes[order], scores[order], log_p_values[order]
+        top = np.arange(len(owner)) - np.searchsorted(owner, owner) < top_k
+        owner, codes, scores, log_p_values = owner[top], codes[top], scores[top], log_p_values[top]
+        rescored = len(np.unique(rows))
+
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(owner, minlength=len(keys)))
+    memo.carry_over(key, keys, offsets, codes, scores, log_p_values, memo.last_used[kept])
+    return rescored
+
+def score_candidates(pssms, enzymes, windows):
+    '''
+    PSSM scores of pairs of enzymes and windows.
 
     args:
-        pssm: Position specific scoring matrix for the match.
-        cleavage_site: String of the cleaved amino acid sequence.
+        pssms: [n_enzymes, 8, 21] PSSM tensor.
+        enzymes: Index of the enzyme of each pair.
+        windows: (n, 8) array with the window of each pair.
 
     returns:
-        score: Number indicating how good a match is.
+        np.ndarray: Score of each pair, summed in the same order as calculate_pssm_score.
     '''
 
-    return pssm[site_columns_index, window].sum()
+    site = [pssms[enzymes, i, windows[:, i]] for i in site_columns_index]
+    return ((site[0] + site[1]) + (site[2] + site[3])) + ((site[4] + site[5]) + (site[6] + site[7]))
 
-def precalculate_expected_p_values(pssms, background):
+def find_top_matches(windows, matcher, pssms, null, k=1, max_chunk_bytes=MAX_CHUNK_BYTES, n_workers=1):
+    '''
+    Find the k best scoring candidate enzymes of each window.
 
-    mus = defaultdict(int)
-    sigmas = defaultdict(int)
+    The windows are processed in chunks whose candidate mask takes at most max_chunk_bytes. Only
+    the pairs of windows and matching enzymes are scored, the k best pairs of each window are
+    selected from the scores of one pass, see top_candidates. Equal scores go to the enzyme first
+    in matcher.codes.
 
-    relative_bg = normalize_background(background)
-    bg_array = np.array([relative_bg[aa] for aa in alphabet], dtype=float)
+    With more than one worker, large batches of windows are split into ranges that are matched in
+    a process pool. The windows, PSSMs and tables are published once in shared memory.
 
-    for code in pssms:
-        pssm = pssms[code]
-        score_matrix = np.array([[pssm[s][i] for i in alphabet_index] for s in site_columns_index])
+    args:
+        windows: (n, 8) array of amino acid indices.
+        matcher: CandidateMatcher of all candidate enzymes.
+        pssms: Dictionary with the position specific scoring matrix of each enzyme code.
+        null: ScoreDistributions of the enzymes in matcher.codes, see null_distributions.
+        k: Number of candidates per window.
+        max_chunk_bytes: Bound on the size of the candidate mask of one chunk.
+        n_workers: Number of worker processes, None for CLEAVVIZ_MAX_WORKERS, see sharding.resolve_workers.
 
-        # Per-site expected score under background
-        exp_per_site = score_matrix.dot(bg_array)
+    returns:
+        rows: Index of the window of each match, windows without a matching enzyme are left out.
+        codes: Enzyme code of each match.
+        scores: PSSM score of each match.
+        log_p_values: Natural logarithm of the p-value of each match.
+        The matches are sorted by window and then by rank.
+    '''
 
-        # Per-site second moment -> E[s^2] = sum p(a) * s(a)^2
-        e2_per_site = (score_matrix**2).dot(bg_array)
-        var_per_site = e2_per_site - exp_per_site**2
+    if k < 1:
+        raise ValueError(f"k has to be at least 1, got {k}.")
 
-        mu = exp_per_site.sum()
-        sigma2 = var_per_site.sum()
-        sigma = math.sqrt(sigma2) if sigma2 > 0 else 0.0
+    windows = np.asarray(windows, dtype=np.intp).reshape(-1, len(site_columns_index))
+    if len(matcher) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=object), np.zeros(0), np.zeros(0)
 
-        mus[code] = mu
-        sigmas[code] = sigma
+    pssm_tensor = np.stack([pssms[code] for code in matcher.codes])
 
-    return mus, sigmas
+    n_workers = min(resolve_workers(n_workers), len(windows) // MIN_PARALLEL_WINDOWS)
+    if n_workers > 1:
+        rows, enzymes, scores, log_p_values = _match_in_pool(windows, matcher, pssm_tensor, null, max_chunk_bytes, k, n_workers)
+    else:
+        rows, enzymes, scores, log_p_values = _match_windows(windows, matcher, pssm_tensor, null, max_chunk_bytes, k)
 
+    return rows, np.array(matcher.codes, dtype=object)[enzymes], scores, log_p_values
 
-def calculate_p_value(score, cleavage_window, mu, sigma):
+def top_candidates(rows, scores, k):
     '''
-    Calculate the p_value for a match.
+    Select the k best scoring pairs of each window.
 
     args:
-        pssm: Position specific scoring matrix for the match
-        cleavage_site: String of the cleaved amino acid sequence.
-        background_frequency: Dictionary containing background frequencies representing the probability of each amino acid at a random position.
-    
+        rows: Window of each pair, sorted. Pairs of the same window are sorted by enzyme.
+        scores: Score of each pair.
+        k: Number of pairs to keep per window.
+
+    returns:
+        np.ndarray: Indices of the selected pairs, sorted by window and then by rank. Equal scores
+                    are ranked by enzyme.
+    '''
+
+    first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    counts = np.diff(np.r_[first, len(rows)])
+
+    if k == 1:
+        # keep the first maximum of each window
+        is_best = scores == np.repeat(np.maximum.reduceat(scores, first), counts)
+        candidates = np.flatnonzero(is_best)
+        return candidates[np.r_[True, rows[candidates[1:]] != rows[candidates[:-1]]]]
+
+    # scores of each window in one row, padded with -inf
+    width = counts.max()
+    segments = np.repeat(np.arange(len(first)), counts)
+    columns = np.arange(len(rows)) - np.repeat(first, counts)
+    dense = np.full((len(first), width), -np.inf)
+    dense[segments, columns] = scores
+    valid = np.arange(width) < counts[:, None]
+
+    take = valid
+    if k < width:
+        # k-th best score of each window, ties at the k-th place go to the first enzymes
+        kth = np.take_along_axis(dense, np.argpartition(-dense, k - 1, axis=1)[:, k - 1:k], axis=1)
+        greater = dense > kth
+        equal = (dense == kth) & valid
+        take = greater | (equal & (np.cumsum(equal, axis=1) <= k - greater.sum(axis=1, keepdims=True)))
+
+    segments, columns = np.nonzero(take)
+    selected = first[segments] + columns
+    return selected[np.lexsort((selected, -scores[selected], segments))]
+
+def _match_windows(windows, matcher, pssm_tensor, null, max_chunk_bytes, k):
+    '''
     returns:
-        p_value: Number for a match between 0 and 1 indicating how statistically significant the match is.
+        rows, enzymes, scores, log_p_values: Window, index of the enzyme, score and log p-value of the
+                                             k best matches of each window, see find_top_matches.
     '''
 
-    # handle degenerate sigma
-    if sigma == 0:
-        # If sigma 0, the score doesn't vary under null; then p is 0 or 1
-        p = 0.0 if score > mu else 1.0
-        return p
+    chunk_size = max(1, max_chunk_bytes // len(matcher))
+
+    matches = [(np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0))]
+    for start in range(0, len(windows), chunk_size):
+        chunk = windows[start:start + chunk_size]
+        rows, enzymes = np.nonzero(matcher.match_mask(chunk))
+        if len(rows) == 0:
+            continue
+        scores = score_candidates(pssm_tensor, enzymes, chunk[rows])
+
+        selected = top_candidates(rows, scores, k)
+        matches.append((start + rows[selected], enzymes[selected], scores[selected]))
+
+    rows, enzymes, scores = (np.concatenate(column) for column in zip(*matches))
+    return rows, enzymes, scores, null.log_p_values(enzymes, windows[rows])
+
+# state of a matching worker process, set by _init_match_worker
+_worker = None
+
+def _init_match_worker(spec, codes, step, max_chunk_bytes, k):
+    global _worker
+    arrays, blocks = attach_shared_arrays(spec)
+    matcher = CandidateMatcher.from_table(codes, arrays["table"])
+    null = ScoreDistributions(step, arrays["bins"], arrays["offsets"], arrays["starts"], arrays["log_sf"])
+    _worker = (arrays["windows"], matcher, arrays["pssms"], null, max_chunk_bytes, k, blocks)
 
-    z = (score - mu) / sigma
-    p_value = 1.0 - norm.cdf(z)
-    return p_value
+def _match_range(start, stop):
+    windows, matcher, pssm_tensor, null, max_chunk_bytes, k, _ = _worker
+    rows, enzymes, scores, log_p_values = _match_windows(windows[start:stop], matcher, pssm_tensor, null, max_chunk_bytes, k)
+    return start + rows, enzymes, scores, log_p_values
+
+def _match_in_pool(windows, matcher, pssm_tensor, null, max_chunk_bytes, k, n_workers):
+    '''Match ranges of windows in a process pool and stitch the results back in order.'''
+
+    arrays = {
+        "windows": windows, "table": matcher.table, "pssms": pssm_tensor,
+        "bins": null.bins, "offsets": null.offsets, "starts": null.starts, "log_sf": null.log_sf,
+    }
+    # a few ranges per worker even out their load
+    bounds = np.linspace(0, len(windows), n_workers * 4 + 1).astype(np.int64)
+    starts, stops = bounds[:-1].tolist(), bounds[1:].tolist()
+
+    with shared_arrays(arrays) as spec:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_match_worker,
+                                 initargs=(spec, matcher.codes, null.step, max_chunk_bytes, k)) as pool:
+            results = list(pool.map(_match_range, starts, stops))
+
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+def calculate_pssm_score(pssm, window):
+    '''
+    Calculate the pssm-score for a match.
+
+    args:
+        pssm: Position specific scoring matrix for the match.
+        cleavage_site: String of the cleaved amino acid sequence.
+
+    returns:
+        score: Number indicating how good a match is.
+    '''
+
+    return pssm[site_columns_index, window].sum()
@@ -0,0 +1,220 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .cleavage_result import csr_take
+
+# enough for the distinct peptides or windows of many large uploads
+DEFAULT_MAX_ENTRIES = 1 << 20
+
+class Memo:
+    '''
+    Results of earlier calculations that are kept across uploads.
+
+    The entries are only valid for one state, e.g. one fasta file, given by a key.
+    validate drops all entries as soon as the key changes. At most max_entries are kept, the least
+    recently used entries are dropped first.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.key = None
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, key):
+        '''Drop all entries if they were calculated for a different key.'''
+        if key != self.key:
+            self.key = key
+            self.entries = OrderedDict()
+
+    def carry_over(self, key, entries):
+        '''Switch to a new key, keeping the given entries that are still valid for it.'''
+        self.key = key
+        self.entries = OrderedDict(entries)
+        self._evict()
+
+    def split(self, keys):
+        '''
+        Look up a list of keys.
+
+        args:
+            keys: List of hashable keys.
+
+        returns:
+            results: List with the stored result of each key, None if the key is not stored.
+            missing: List of the unique keys without a stored result, in order of appearance.
+        '''
+
+        results = [self.entries.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, result in zip(keys, results) if result is None))
+        for key in dict.fromkeys(key for key, result in zip(keys, results) if result is not None):
+            self.entries.move_to_end(key)
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        return results, missing
+
+    def update(self, keys, results):
+        '''Store results, the entries of the current lookup may be evicted if there are more than max_entries.'''
+        self.entries.update(zip(keys, results))
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio}
+
+
+class MatchMemo:
+    '''
+    Ranked candidate enzymes of the cleavage windows seen before, stored column by column.
+
+    The windows are kept as sorted packed keys, see helper.pack_windows, so all windows of an upload
+    are looked up with one search. The candidates of keys[i] are enzymes[offsets[i]:offsets[i + 1]],
+    enzymes index codes, with their scores and log p-values in the same slots.
+
+    Like Memo, the entries are only valid for one key and validate drops them as soon as it changes.
+    At most max_entries windows are kept, the least recently used windows are dropped by evict.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.key = None
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.clock = 0
+        self._clear()
+
+    def _clear(self):
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.last_used = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.enzymes = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0)
+        self.log_p_values = np.zeros(0)
+        self.codes = np.zeros(0, dtype=object)
+
+    def validate(self, key):
+        '''Drop all entries if they were calculated for a different key.'''
+        if key != self.key:
+            self.key = key
+            self._clear()
+
+    def _find(self, keys):
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return positions, found
+
+    def missing(self, keys):
+        '''
+        Look up windows and mark the stored ones as used.
+
+        args:
+            keys: Sorted unique uint64 array of packed windows.
+
+        returns:
+            np.ndarray: The keys without stored candidates.
+        '''
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        positions, found = self._find(keys)
+        self.clock += 1
+        self.last_used[positions[found]] = self.clock
+        hits = int(found.sum())
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return keys[~found]
+
+    def code_indices(self, codes):
+        '''Index of each enzyme code in codes, codes not seen before are added.'''
+        codes = np.asarray(codes, dtype=object)
+        new = pd.Index(pd.unique(codes)).difference(pd.Index(self.codes), sort=False)
+        self.codes = np.concatenate([self.codes, new.to_numpy(dtype=object)])
+        return pd.Index(self.codes).get_indexer(codes).astype(np.int32)
+
+    def insert(self, keys, offsets, codes, scores, log_p_values):
+        '''
+        Store the candidates of windows that are not stored yet.
+
+        args:
+            keys: Sorted unique uint64 array of packed windows.
+            offsets: The candidates of keys[i] are the values offsets[i]:offsets[i + 1] of the other arrays.
+            codes: Enzyme code of each candidate.
+            scores: PSSM score of each candidate.
+            log_p_values: Natural logarithm of the p-value of each candidate.
+        '''
+
+        enzymes = self.code_indices(codes)
+        self.keys = np.concatenate([self.keys, np.asarray(keys, dtype=np.uint64)])
+        self.last_used = np.concatenate([self.last_used, np.full(len(keys), self.clock, dtype=np.int64)])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.asarray(offsets[1:], dtype=np.int64)])
+        self.enzymes = np.concatenate([self.enzymes, enzymes])
+        self.scores = np.concatenate([self.scores, scores])
+        self.log_p_values = np.concatenate([self.log_p_values, log_p_values])
+        self._select(np.argsort(self.keys, kind="stable"))
+
+    def candidates(self, keys):
+        '''
+        Candidates of stored windows.
+
+        args:
+            keys: uint64 array of stored packed windows.
+
+        returns:
+            offsets: The candidates of keys[i] are the values offsets[i]:offsets[i + 1] of the other arrays.
+            enzymes: Index of the enzyme code of each candidate in codes.
+            scores: PSSM score of each candidate.
+            log_p_values: Natural logarithm of the p-value of each candidate.
+        '''
+
+        positions, _ = self._find(np.asarray(keys, dtype=np.uint64))
+        offsets, flat = csr_take(self.offsets, positions)
+        return offsets, self.enzymes[flat], self.scores[flat], self.log_p_values[flat]
+
+    def evict(self):
+        '''Drop the least recently used windows beyond max_entries.'''
+        if len(self.keys) > self.max_entries:
+            recent = np.argsort(self.last_used, kind="stable")[len(self.keys) - self.max_entries:]
+            self._select(np.sort(recent))
+
+    def carry_over(self, key, keys, offsets, codes, scores, log_p_values, last_used):
+        '''Switch to a new key, keeping the given candidates that are still valid for it.'''
+        self.key = key
+        self._clear()
+        self.keys = keys
+        self.last_used = last_used
+        self.offsets = offsets
+        self.enzymes = self.code_indices(codes)
+        self.scores = scores
+        self.log_p_values = log_p_values
+        self.evict()
+
+    def _select(self, rows):
+        self.offsets, flat = csr_take(self.offsets, rows)
+        self.keys = self.keys[rows]
+        self.last_used = self.last_used[rows]
+        self.enzymes = self.enzymes[flat]
+        self.scores = self.scores[flat]
+        self.log_p_values = self.log_p_values[flat]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio}
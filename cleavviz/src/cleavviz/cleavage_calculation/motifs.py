@@ -1,39 +1,81 @@
-import pandas as pd
 import numpy as np
-from Bio import motifs
 from collections import defaultdict
-from .constants import amino_acids, alphabet, alphabet_index, site_columns, site_columns_index, base_enzymes, base_enzyme_codes, base_enzyme_codes_without_P
+from .constants import amino_acids, alphabet, alphabet_index, site_columns, site_columns_index, base_enzymes, base_enzyme_codes
 
-def calculate_pssms(counts_by_code, background):
+# amino acids scoring above this log-odds at a site are enriched and make up the regex pattern of the site
+REGEX_THRESHOLD = 1.68
+
+def get_count_tensor(enzyme_df):
     '''
-    Calculate the position specific scoring matrices for all enzyme candidates.
+    Reshape the Site_<site>_<aa> columns of an enzyme dataframe into a count tensor.
 
     args:
-        counts_by_code: Dictionary containing all observed cleavages for all enzyme candidates.
-        background: Dictionary with the total count of each amino acid.
+        enzyme_df: Pandas dataframe containing enzyme candidates along with their observed cleavages.
 
     returns:
-        pssms: List of all position specific scoring matrices for all enzyme candidates.
+        np.ndarray: float [n_enzymes, 8, 20] with the observed amino acids at the sites P4 to P4'.
+    '''
+
+    columns = [f"{site}_{aa}" for site in site_columns for aa in amino_acids]
+    counts = enzyme_df.reindex(columns=columns).fillna(0).to_numpy(dtype=float)
+    return counts.reshape(len(enzyme_df), len(site_columns), len(amino_acids))
+
+
+def calculate_log_frequencies(counts):
+    '''
+    Background independent part of the position specific scoring matrices.
+
+    args:
+        counts: Count tensor [..., 20], see get_count_tensor.
+
+    returns:
+        np.ndarray: log2 of the relative frequencies of each amino acid with a pseudocount of 1.
     '''
 
-    pssms = defaultdict(list)
+    counts = np.asarray(counts, dtype=float)
+    return np.log2((counts + 1) / (counts.sum(axis=-1, keepdims=True) + len(alphabet)))
 
-    for code in counts_by_code:
 
-        site_counts = counts_by_code[code]
-        counts_dict = {aa: list(site_counts[aa]) for aa in site_counts.columns}
-        m = motifs.Motif(counts=counts_dict, alphabet=alphabet)
-        m.background = background
-        m.pseudocounts = 1
-        pssm = m.pssm
+def apply_background(log_frequencies, background):
+    '''
+    Turn log frequencies into log-odds against a background with one broadcast.
 
-        pssm_array = np.array([[pssm[aa][i] for aa in alphabet] + [0] for i in range(len(site_columns))])
+    args:
+        log_frequencies: Tensor [n_enzymes, 8, 20], see calculate_log_frequencies.
+        background: Dictionary with the total count of each amino acid, normalised over the 20 amino acids.
 
-        pssms[code] = pssm_array
+    returns:
+        np.ndarray: [n_enzymes, 8, 21] log-odds, the last column scores X with 0.
+    '''
 
+    background = np.array([background[aa] for aa in alphabet], dtype=float)
+
+    pssms = np.zeros(log_frequencies.shape[:2] + (len(alphabet) + 1,))
+    pssms[:, :, :len(alphabet)] = log_frequencies - np.log2(background / background.sum())
     return pssms
 
 
+def background_P1prime(log_frequencies, without_P, background):
+    '''
+    The /P variants accept any amino acid after the cleavage, so their P1' follows the background.
+
+    args:
+        log_frequencies: Tensor [n_enzymes, 8, 20], see calculate_log_frequencies.
+        without_P: Boolean mask of the /P variants among the enzymes.
+        background: Dictionary with the total count of each amino acid.
+
+    returns:
+        np.ndarray: Log frequencies with the P1' site of the /P variants replaced, a copy if any was replaced.
+    '''
+
+    if not without_P.any():
+        return log_frequencies
+
+    log_frequencies = np.array(log_frequencies)
+    log_frequencies[without_P, site_columns.index("Site_P1prime")] = calculate_log_frequencies([background[aa] for aa in amino_acids])
+    return log_frequencies
+
+
 def pssm_to_regex(pssms):
     '''
     Create a regex patterns from position specific scoring matrices.
@@ -54,10 +96,10 @@ def pssm_to_regex(pssms):
             continue
         regex=[]
         for i in site_columns_index:
-            enriched_aa_list = [alphabet[j] for j in alphabet_index if pssm[i][j] > 1.68]
+            enriched_aa_list = [alphabet[j] for j in alphabet_index if pssm[i][j] > REGEX_THRESHOLD]
 
             if len(enriched_aa_list) == 0:
-                depleted_aa_list = [("!"+alphabet[j]) for j in alphabet_index if pssm[i][j] < -1.68]
+                depleted_aa_list = [("!"+alphabet[j]) for j in alphabet_index if pssm[i][j] < -REGEX_THRESHOLD]
                 if len(enriched_aa_list):
                     regex.append(depleted_aa_list)
                 else:
@@ -70,38 +112,23 @@ def pssm_to_regex(pssms):
     return regexes
 
 
-def analyze_enzymes(enzyme_df, background):
+def pssm_to_regex_masks(pssms):
     '''
-    Analyze all candidate enzymes, calculate position specific scoring matrices and create regex patterns
+    Create the regex patterns of pssm_to_regex as amino acid masks, for all enzymes at once.
+
+    Base enzymes keep their fixed patterns in pssm_to_regex, their masks have to be taken from there.
 
     args:
-        enzyme_df: Pandas dataframe containing all enzyme candidates along with their observed cleavages.
-        background: Dictionary with the total count of each amino acid.
+        pssms: [n_enzymes, 8, 21] PSSM tensor.
 
     returns:
-        pssms: List of all position specific scoring matrices for all enzyme candidates.
-        regexes: Dictionary of regex patterns for all enzyme candidates.  
-        code_to_name: Dicionary to map enzyme code to their real name.
+        masks: [n_enzymes, 8, 21] boolean, the amino acids allowed at each site, see candidate_matcher.token_mask.
+        wildcard: [n_enzymes, 8] boolean, True for the sites with the pattern ["X"].
     '''
 
-    counts_by_code = defaultdict(lambda: pd.DataFrame(0, index=site_columns, columns=amino_acids))
-    code_to_name = defaultdict(str)
+    enriched = pssms[:, :, :len(alphabet)] > REGEX_THRESHOLD
+    wildcard = ~enriched.any(axis=2)
 
-    for _, row in enzyme_df.iterrows():
-
-        code = row["code"]
-        code_to_name[row["code"]] = row["enzyme_name"]
-
-        for pos in site_columns:
-            for aa in amino_acids:
-                col_name = f"{pos}_{aa}"
-                if col_name in row and pd.notna(row[col_name]):
-                    counts_by_code[code].at[pos, aa] = row[col_name]
-        if code in base_enzyme_codes_without_P:
-            for aa in amino_acids:
-                counts_by_code[code].at["Site_P1prime",aa] = background[aa]
-
-    pssms = calculate_pssms(counts_by_code,background)
-    regexes = pssm_to_regex(pssms)
-    
-    return pssms, regexes, code_to_name
+    masks = np.zeros(pssms.shape, dtype=bool)
+    masks[:, :, :len(alphabet)] = enriched | wildcard[:, :, None]
+    return masks, wildcard
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from .constants import alphabet
+
+# resolution of the discretised scores in bits
+DEFAULT_SCORE_STEP = 0.01
+# score distributions of single enzymes kept across enzyme selections, a few database sizes
+DEFAULT_MAX_ENZYMES = 4096
+
+@dataclass
+class ScoreDistributions:
+    '''
+    Exact distributions of the PSSM scores of windows drawn from the background.
+
+    The scores of every site are rounded to multiples of step, so the distribution of the score of
+    an enzyme is the convolution of its eight site distributions. The survival function of enzyme
+    i over the scores offsets[i] + j, j = 0, 1, ... in units of step is stored in
+    log_sf[starts[i]:starts[i + 1]]. As the grid is uniform, the p-value of a score is found by
+    index arithmetic instead of a search.
+
+    bins: [n_enzymes, 8, 21] scores in units of step, X scores 0.
+    '''
+
+    step: float
+    bins: np.ndarray
+    offsets: np.ndarray
+    starts: np.ndarray
+    log_sf: np.ndarray
+
+    @classmethod
+    def from_pssms(cls, pssms, background, step=DEFAULT_SCORE_STEP):
+        '''
+        Compute the score distributions of all enzymes.
+
+        args:
+            pssms: [n_enzymes, 8, 21] PSSM tensor.
+            background: Dictionary with the total count of each amino acid, normalised over the 20 amino acids.
+            step: Resolution of the discretised scores.
+
+        returns:
+            ScoreDistributions
+        '''
+
+        probabilities = np.array([background[aa] for aa in alphabet], dtype=float)
+        probabilities /= probabilities.sum()
+
+        bins = np.zeros(pssms.shape, dtype=np.int64)
+        bins[:, :, :len(alphabet)] = np.rint(pssms[:, :, :len(alphabet)] / step)
+
+        site_minimum = bins[:, :, :len(alphabet)].min(axis=2)
+        site_bins = bins[:, :, :len(alphabet)] - site_minimum[:, :, None]
+        offsets = site_minimum.sum(axis=1)
+
+        survival = []
+        for enzyme_bins in site_bins:
+            pmf = np.ones(1)
+            for shifts in enzyme_bins:
+                convolved = np.zeros(len(pmf) + shifts.max())
+                for shift, probability in zip(shifts.tolist(), probabilities.tolist()):
+                    convolved[shift:shift + len(pmf)] += probability * pmf
+                pmf = convolved
+            # summed from the tail, so small tail probabilities keep their precision
+            survival.append(np.cumsum(pmf[::-1])[::-1])
+
+        starts = np.zeros(len(survival) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum([len(sf) for sf in survival])
+        with np.errstate(divide="ignore"):
+            log_sf = np.log(np.concatenate(survival)) if survival else np.zeros(0)
+
+        return cls(step, bins, offsets, starts, log_sf)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def take(self, enzymes):
+        '''
+        args:
+            enzymes: Indices of enzymes.
+
+        returns:
+            ScoreDistributions of the selected enzymes.
+        '''
+
+        enzymes = np.asarray(enzymes, dtype=np.intp)
+        lengths = self.starts[enzymes + 1] - self.starts[enzymes]
+        starts = np.zeros(len(enzymes) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum(lengths)
+        flat = np.repeat(self.starts[enzymes] - starts[:-1], lengths) + np.arange(starts[-1])
+        return ScoreDistributions(self.step, self.bins[enzymes], self.offsets[enzymes], starts, self.log_sf[flat])
+
+    @classmethod
+    def concatenate(cls, parts):
+        '''
+        args:
+            parts: Non-empty list of ScoreDistributions with the same step.
+
+        returns:
+            ScoreDistributions of the enzymes of all parts, in order.
+        '''
+
+        starts = np.zeros(sum(len(part) for part in parts) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum(np.concatenate([np.diff(part.starts) for part in parts]))
+        return cls(parts[0].step,
+                   np.concatenate([part.bins for part in parts]),
+                   np.concatenate([part.offsets for part in parts]),
+                   starts,
+                   np.concatenate([part.log_sf for part in parts]))
+
+    def log_p_values(self, enzymes, windows):
+        '''
+        Log p-values of windows matched to enzymes, the probability of a score at least as high.
+
+        args:
+            enzymes: Index of the enzyme of each window.
+            windows: (n, 8) array of amino acid indices.
+
+        returns:
+            np.ndarray: Natural logarithm of the p-value of each window.
+        '''
+
+        enzymes = np.asarray(enzymes, dtype=np.intp)
+        windows = np.asarray(windows, dtype=np.intp)
+        scores = self.bins[enzymes[:, None], np.arange(windows.shape[1]), windows].sum(axis=1)
+
+        index = np.clip(scores - self.offsets[enzymes], 0, self.starts[enzymes + 1] - self.starts[enzymes] - 1)
+        return self.log_sf[self.starts[enzymes] + index]
+
+
+class ScoreDistributionCache:
+    '''
+    Least recently used cache of the score distributions of single enzymes.
+
+    The distribution of an enzyme only depends on its PSSM, so it is keyed by the enzyme code and
+    the digest of the background. A changed enzyme selection only computes the distributions of the
+    enzymes that were not selected before.
+    '''
+
+    def __init__(self, max_enzymes=DEFAULT_MAX_ENZYMES):
+        self.max_enzymes = max_enzymes
+        self.distributions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, codes, pssms, background, digest):
+        '''
+        args:
+            codes: Enzyme code of each PSSM.
+            pssms: [n_enzymes, 8, 21] PSSM tensor.
+            background: Dictionary with the total count of each amino acid.
+            digest: Digest of the background, see enzyme_models.background_digest.
+
+        returns:
+            ScoreDistributions of the enzymes in the order of codes.
+        '''
+
+        keys = [(code, digest) for code in codes]
+        if not keys:
+            return ScoreDistributions.from_pssms(pssms, background)
+
+        missing = [i for i, key in enumerate(keys) if key not in self.distributions]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            computed = ScoreDistributions.from_pssms(pssms[missing], background)
+            for j, i in enumerate(missing):
+                self.distributions[keys[i]] = computed.take([j])
+
+        for key in keys:
+            self.distributions.move_to_end(key)
+        null = ScoreDistributions.concatenate([self.distributions[key] for key in keys])
+        while len(self.distributions) > self.max_enzymes:
+            self.distributions.popitem(last=False)
+        return null
+
+    def __len__(self):
+        return len(self.distributions)
@@ -1,62 +1,79 @@
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+from .constants import alphabet_with_X
 from .helper import counts_to_relative_motif
 
-def accumulate_results(results, proteinID, metadata_filter):
+def accumulate_results(results, proteinID, metadata_filter, assignment="best"):
     '''
     Accumulate results for filter settings.
 
     args:
-        results: Pandas dataframe containing all information for each cleavage.
+        results: CleavageResult with the matched enzymes of each cleavage, filtered by slicing if it is sorted by protein.
         proteinID: String.
         metadata_filter: Dictionary with all metadata filter settings.
+        assignment: "best" or "fractional", see CleavageResult.assignments.
 
     returns:
         Dictionary containing the wanted output data for the top k enzymes.
     '''
 
-    mask = pd.Series(True, index=results.index)
-    mask &= results["proteinID"] == proteinID
+    # a slice if the results are sorted by protein, so only the cleavages of the protein are filtered
+    filtered_results = results.take(results.protein_rows(proteinID))
 
     if metadata_filter is not None:
+        mask = np.ones(len(filtered_results), dtype=bool)
         for _, values in metadata_filter.items():
             if len(values) > 0:
-                submask = results["sample"].apply(lambda x: any(v in x for v in values))
-                mask &= submask
+                mask &= filtered_results.in_samples(values)
+        filtered_results = filtered_results.take(mask)
 
-    filtered_results = results[mask]
+    return group_by_enzyme(filtered_results, assignment=assignment)
 
-    return group_by_enzyme(filtered_results)
 
-
-def group_by_enzyme(df, k=3):
+def group_by_enzyme(results, k=3, assignment="best"):
     '''
     Group enzymes and calculate their wanted output data.
 
     args:
-        df: Filtered Pandas dataframe containing all information for each cleavage
+        results: Filtered CleavageResult.
+        k: Number of enzymes with the most cleavages to summarise, None for all.
+        assignment: "best" to count each cleavage for its best enzyme, "fractional" to split it between its
+                    candidates, see CleavageResult.assignments.
 
     returns:
-        Dictionary containing the wanted output data for the top k enzymes.
+        Dictionary containing the wanted output data for the top k enzymes. With fractional assignment the
+        counts are weighted and the p_value is the weighted mean.
     '''
 
-    enzyme_counts = df["enzyme"].value_counts()
+    rows, enzyme_codes, weights, p_values = results.assignments(assignment)
+    enzymes = np.asarray(results.enzymes.categories, dtype=object)[enzyme_codes]
+
+    enzyme_counts = pd.Series(weights).groupby(enzymes, sort=False).sum().sort_values(ascending=False, kind="stable")
     enzyme_summary = {}
 
+    selected = sorted(enzyme_counts.index)
     if k is not None:
-        top_enzymes = set(enzyme_counts.nlargest(k).index)
-        df = df[df["enzyme"].isin(top_enzymes)]
-
-    for enzyme, group in df.groupby("enzyme"):
-        position_dicts = [defaultdict(int) for _ in range(8)]
-
-        for cleavage_site in group["cleavage_site"]:
-            for i, aa in enumerate(cleavage_site):
-                position_dicts[i][aa] += 1
-
-        mean_p = group["p_value"].mean()
-        unique_positions = sorted(set(group["position"]))
-        total_count = len(group)
+        selected = sorted(set(enzyme_counts.nlargest(k).index))
+
+    for enzyme in selected:
+        assigned = enzymes == enzyme
+        enzyme_rows = rows[assigned]
+        enzyme_weights = weights[assigned]
+        windows = results.windows[enzyme_rows]
+
+        # count the amino acids at each site of the cleavage windows
+        counts = np.stack([np.bincount(site, weights=enzyme_weights, minlength=len(alphabet_with_X)) for site in windows.T.astype(np.intp)])
+        position_dicts = [defaultdict(int, {aa: count for aa, count in zip(alphabet_with_X, site_counts) if count}) for site_counts in counts]
+
+        enzyme_p_values = p_values[assigned]
+        has_p_value = ~np.isnan(enzyme_p_values)
+        mean_p = np.average(enzyme_p_values[has_p_value], weights=enzyme_weights[has_p_value]) if has_p_value.any() else np.nan
+        positions = results.positions[enzyme_rows]
+        unique_positions = np.unique(positions[positions >= 0]).tolist()
+        total_count = enzyme_weights.sum()
+        if assignment == "best":
+            total_count = int(total_count)
         motif = counts_to_relative_motif(position_dicts)
 
         enzyme_summary[enzyme] = {
@@ -70,4 +87,4 @@ def group_by_enzyme(df, k=3):
         sorted(enzyme_summary.items(), key=lambda x: x[1]["total_count"], reverse=True)
     )
 
-    return enzyme_summary
\ No newline at end of file
+    return enzyme_summary
@@ -1,9 +1,12 @@
+import numpy as np
 import pandas as pd
-from .constants import base_enzyme_codes, base_enzymes
+from .enzyme_db import load_enzyme_db
+from .helper import pack_windows
+from .memo import Memo
 
 def get_enzyme_df():
     '''
-    Extract enzyme_df from parquet file and insert base_enzymes
+    Load the precompiled enzyme database, see enzyme_db.
 
     returns:
         enzyme_df: Pandas Dataframe containing all enzymes and their associated information.
@@ -11,16 +14,7 @@ def get_enzyme_df():
         possible_enzymes: List of all enzymes represented in the enzyme database.
     '''
 
-    enzyme_df = pd.read_parquet("../cleavviz/src/cleavviz/cleavage_calculation/enzyme_motifs.parquet", engine="pyarrow")
-
-    for code in base_enzyme_codes:
-        if code[-2:] == "/P":
-            row = enzyme_df[enzyme_df["code"] == code[:-2]].iloc[0].copy()
-            row["enzyme_name"] = base_enzymes[code]["name"]
-            row["code"] = code
-            enzyme_df = pd.concat([enzyme_df, pd.DataFrame([row])], ignore_index=True)
-        else:
-            enzyme_df.loc[enzyme_df["code"] == code, "enzyme_name"] = base_enzymes[code]["name"]
+    enzyme_df = load_enzyme_db().to_dataframe()
 
     possible_species = [s for s in enzyme_df["species"].unique().tolist() if s is not None]
     possible_enzymes = [s for s in enzyme_df["enzyme_name"].unique().tolist() if s is not None]
@@ -29,47 +23,154 @@ def get_enzyme_df():
 
 
 def get_filtered_enzyme_df(enzyme_df, use_standard_enzymes, species, enzymes):
+    '''
+    Select the enzyme candidates, see enzyme_db.EnzymeSelector.
+
+    args:
+        enzyme_df: Pandas dataframe of the enzyme database, see get_enzyme_df.
+        use_standard_enzymes: Whether to include the standard enzymes.
+        species: Species or list of species whose enzymes are included.
+        enzymes: List of enzyme names to include.
+
+    returns:
+        Pandas dataframe with the selected rows of enzyme_df, all rows if nothing is selected.
+    '''
+
+    return enzyme_df.iloc[load_enzyme_db().selector.select(use_standard_enzymes, species, enzymes)]
+
+
+def get_claims(peptide_df, sequences):
+    '''
+    Protein and start position the peptide table gives for each sequence.
+
+    args:
+        peptide_df: Pandas dataframe containing all observed peptides and their associated information.
+        sequences: Sorted unique peptide sequences.
+
+    returns:
+        protein_ids: List with the Protein ID of each sequence, None if unknown.
+        starts: List with the 1-based Start of each sequence, None if unknown.
+    '''
+
+    columns = [column for column in ("Protein ID", "Start") if column in peptide_df.columns]
+    # protein and start of a claim come from the same row
+    claims = peptide_df.drop_duplicates("Sequence", keep="first").set_index("Sequence")[columns].reindex(sequences)
+
+    protein_ids, starts = [None] * len(sequences), [None] * len(sequences)
+    if "Protein ID" in claims.columns:
+        protein_ids = claims["Protein ID"].astype(object).where(claims["Protein ID"].notna(), None).tolist()
+    if "Start" in claims.columns:
+        numeric = pd.to_numeric(claims["Start"], errors="coerce")
+        starts = [None if pd.isna(start) else int(start) for start in numeric]
+    return protein_ids, starts
+
 
+def get_claimed_positions(sequences, protein_ids, starts, proteome):
+    '''
+    Locate peptides in the protein claimed by the peptide table.
+
+    A Start position is trusted if the protein substring at Start equals the peptide, otherwise the
+    peptide is searched in the claimed protein only.
+
+    args:
+        sequences: List of peptide sequences.
+        protein_ids: Claimed Protein ID of each sequence, None if unknown.
+        starts: Claimed 1-based Start of each sequence, None if unknown.
+        proteome: Concatenated and encoded protein sequences.
+
+    returns:
+        rows: Index of each peptide found in its claimed protein.
+        proteins: Index of the claimed protein of these peptides.
+        offsets: 0-based start position of these peptides in their protein.
+        mapping_stats: Dictionary counting the peptides with a claimed protein, a verified Start
+                       position and a claimed protein containing them.
+    '''
+
+    proteins = proteome.protein_indices(protein_ids)
+    offsets = np.array([-1 if start is None else start - 1 for start in starts], dtype=np.int64)
+    verified = proteome.contains_at(proteins, offsets, sequences)
+
+    # without a verified Start the claimed protein is the only candidate
+    searched = np.flatnonzero(~verified & (proteins >= 0))
+    for i in searched.tolist():
+        offsets[i] = proteome.find(proteins[i], sequences[i])
+    found = verified | ((proteins >= 0) & (offsets >= 0))
+
+    mapping_stats = {
+        "claimed": int((proteins >= 0).sum()),
+        "start_verified": int(verified.sum()),
+        "protein_verified": int(found.sum() - verified.sum()),
+        "claim_rejected": int(((proteins >= 0) & ~found).sum()),
+    }
 
-    mask = pd.Series(False, index=enzyme_df.index)
+    rows = np.flatnonzero(found)
+    return rows, proteins[rows].astype(np.int32), offsets[rows], mapping_stats
 
-    if (species == None) and (enzymes == None or enzymes == []) and (not use_standard_enzymes):
-        return enzyme_df
-    
-    if use_standard_enzymes:
-        mask |= enzyme_df["code"].isin(base_enzyme_codes)
 
-    if species is not None:
-        mask |= enzyme_df["species"] == species
+def map_sequences(sequences, protein_ids, starts, peptide_index, proteome):
+    '''
+    Map peptides to the proteome, trying their claimed protein first.
+
+    args:
+        sequences: List of peptide sequences.
+        protein_ids: Claimed Protein ID of each sequence, None if unknown.
+        starts: Claimed 1-based Start of each sequence, None if unknown.
+        peptide_index: Index over the proteome providing map_peptides, e.g. a SuffixArray or KmerIndex.
+        proteome: Concatenated and encoded protein sequences.
+
+    returns:
+        rows: Index of the peptide of each occurrence, sorted. Peptides without any
+              occurrence have a single row with protein -1.
+        proteins: Index of the protein of each occurrence.
+        offsets: 0-based start position of each occurrence in its protein.
+        mapping_stats: Dictionary counting how the peptides were mapped.
+    '''
+
+    claimed_rows, claimed_proteins, claimed_offsets, mapping_stats = get_claimed_positions(sequences, protein_ids, starts, proteome)
+
+    # only peptides not found in their claimed protein are searched in the whole proteome
+    searched = np.setdiff1d(np.arange(len(sequences)), claimed_rows)
+    hits = peptide_index.map_peptides([sequences[i] for i in searched], proteome)
+    mapping_stats["fallback_searched"] = len(searched)
+    mapping_stats["fallback_mapped"] = len(np.unique(hits.peptides))
 
-    if enzymes is not None:
-        mask |= enzyme_df["enzyme_name"].isin(enzymes)
+    # peptides without any occurrence keep a single unmatched row
+    matched_rows = np.concatenate([claimed_rows, searched[hits.peptides]])
+    unmatched = np.setdiff1d(np.arange(len(sequences)), matched_rows)
+    mapping_stats["unmapped"] = len(unmatched)
 
-    filtered = enzyme_df[mask]
+    rows = np.concatenate([matched_rows, unmatched])
+    proteins = np.concatenate([claimed_proteins, hits.proteins, np.full(len(unmatched), -1)])
+    offsets = np.concatenate([claimed_offsets, hits.offsets, np.zeros(len(unmatched), dtype=np.int64)])
+    order = np.argsort(rows, kind="stable")
 
-    return filtered
+    return rows[order], proteins[order].astype(np.int64), offsets[order], mapping_stats
 
 
-def get_cleavage_sites(peptide_df, kmer_index, protein_sequences, k=6):
+def get_cleavage_sites(peptide_df, peptide_index, proteome, guided=True, memo=None):
     '''
     Find cleavage sites for all peptides.
 
     args:
         peptide_df: Pandas dataframe containing all observed peptides and their associated information.
-        kmer_index: kmer_index: Dictionary mapping kmers to protein id's.
-        protein_sequences: Dictionary mapping protein id's to protein sequences.
+        peptide_index: Index over the proteome providing map_peptides, e.g. a SuffixArray or KmerIndex.
+        proteome: Concatenated and encoded protein sequences.
+        guided: Look for each peptide in the protein given by its Protein ID first and only search
+                the whole proteome for peptides not found there.
+        memo: Memo with the mapping of sequences seen in earlier uploads, only sequences missing
+              from the memo are mapped. It has to be validated for proteome and mapping settings.
 
     returns:
         peptide_df: Pandas dataframe containing all all observed peptides and their associated information 
-                    along with their matched protein id, cleavage windows and cleavage positions
+                    along with their matched protein id, cleavage windows and cleavage positions.
+                    The windows hold the amino acid indices of P4 to P4', packed by pack_windows.
+                    Peptides occurring in several places have one row per occurrence, unless
+                    they were found in their claimed protein.
+        mapping_stats: Dictionary counting how many of the newly mapped peptides were found in their
+                       claimed protein, how many needed the search in the whole proteome and how
+                       many were not found, plus the number of peptides taken from the memo.
     '''
 
-    n_term_windows = []
-    c_term_windows = []
-    n_term_positions = []
-    c_term_positions = []
-    proteinIDs = []
-
     peptide_df = peptide_df[(peptide_df['Intensity'].notna()) & (peptide_df['Intensity'] > 0)]
 
     grouped = (
@@ -79,42 +180,44 @@ def get_cleavage_sites(peptide_df, kmer_index, protein_sequences, k=6):
         })
         .reset_index()
     )
-    
-    for sequence in grouped["Sequence"]:
-        candidates = kmer_index.get(sequence[:k],[])
-        matched_id = None
-        start_position, end_position = None, None
-
-        if candidates:
-            for id,i in candidates:
-                if sequence == protein_sequences[id][i:i+len(sequence)]:
-                    matched_id = id
-                    start_position = i
-                    end_position = i + len(sequence)
-                    break
-        
-        n_term_window = "X"*8
-        c_term_window = "X"*8
-
-        if matched_id:
-            protein_sequence = protein_sequences[matched_id]
-
-            if (start_position > 3):
-                n_term_window = str(protein_sequence[start_position-4:start_position+4])
-
-            if (end_position < len(protein_sequence) - 4):
-                c_term_window = str(protein_sequence[end_position-4:end_position+4])
-
-        n_term_windows.append(n_term_window)
-        c_term_windows.append(c_term_window)
-        proteinIDs.append(matched_id)
-        n_term_positions.append(start_position)
-        c_term_positions.append(end_position)
-
-    grouped['n_term_cleavage_window'] = n_term_windows
-    grouped['c_term_cleavage_window'] = c_term_windows
-    grouped['proteinID'] = proteinIDs
-    grouped['n_term_position'] = n_term_positions
-    grouped['c_term_position'] = c_term_positions
-
-    return grouped
\ No newline at end of file
+
+    sequences = grouped["Sequence"].tolist()
+    if guided:
+        protein_ids, starts = get_claims(peptide_df, sequences)
+    else:
+        protein_ids, starts = [None] * len(sequences), [None] * len(sequences)
+
+    memo = Memo() if memo is None else memo
+    keys = list(zip(sequences, protein_ids, starts))
+    results, missing = memo.split(keys)
+
+    missing_sequences, missing_protein_ids, missing_starts = (list(column) for column in zip(*missing)) if missing else ([], [], [])
+    rows, proteins, offsets, mapping_stats = map_sequences(missing_sequences, missing_protein_ids, missing_starts, peptide_index, proteome)
+    bounds = np.searchsorted(rows, np.arange(len(missing) + 1))
+    mapped = dict(zip(missing, [(proteins[a:b], offsets[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]))
+    memo.update(mapped.keys(), mapped.values())
+
+    mapping_stats["peptides"] = len(sequences)
+    mapping_stats["memo_hits"] = len(sequences) - len(missing)
+
+    # taken from the lookup, the memo may have evicted entries of a large upload
+    occurrences = [mapped[key] if result is None else result for key, result in zip(keys, results)]
+    counts = np.fromiter((len(protein) for protein, _ in occurrences), dtype=np.int64, count=len(occurrences))
+    rows = np.repeat(np.arange(len(sequences)), counts)
+    proteins = np.concatenate([protein for protein, _ in occurrences] + [np.zeros(0, dtype=np.int64)])
+    offsets = np.concatenate([offset for _, offset in occurrences] + [np.zeros(0, dtype=np.int64)])
+
+    grouped = grouped.iloc[rows].reset_index(drop=True)
+    n_term_positions = offsets
+    c_term_positions = n_term_positions + np.fromiter(map(len, grouped["Sequence"]), dtype=np.int64, count=len(grouped))
+
+    matched = proteins >= 0
+    proteinIDs = np.asarray(proteome.ids + [None], dtype=object)[np.where(matched, proteins, len(proteome))]
+
+    grouped['n_term_cleavage_window'] = pack_windows(proteome.cleavage_windows(proteins, n_term_positions))
+    grouped['c_term_cleavage_window'] = pack_windows(proteome.cleavage_windows(proteins, c_term_positions))
+    grouped['proteinID'] = proteinIDs.tolist()
+    grouped['n_term_position'] = pd.arrays.IntegerArray(n_term_positions, ~matched)
+    grouped['c_term_position'] = pd.arrays.IntegerArray(c_term_positions, ~matched)
+
+    return grouped, mapping_stats
@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from .constants import aa_to_idx
+from .helper import encode_sequence
+
+SEPARATOR = "$"
+
+@dataclass
+class Proteome:
+    '''
+    All protein sequences of a fasta file concatenated into a single buffer.
+
+    Protein i occupies sequence[offsets[i]:offsets[i] + lengths[i]], consecutive proteins are
+    separated by SEPARATOR so that no match can span two proteins.
+    '''
+
+    ids: list
+    sequence: str
+    offsets: np.ndarray
+    lengths: np.ndarray
+    encoded: np.ndarray
+
+    @classmethod
+    def from_fasta(cls, fasta):
+        '''
+        Concatenate all sequences of a fasta dataframe.
+
+        args:
+            fasta: Fasta file containing protein id's and sequences.
+
+        returns:
+            Proteome: Concatenated and encoded protein sequences.
+        '''
+
+        ids = fasta["id"].tolist()
+        sequences = fasta["sequence"].tolist()
+
+        lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+        offsets = np.zeros(len(sequences), dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths + 1)[:-1]
+
+        sequence = SEPARATOR.join(sequences) + SEPARATOR
+
+        return cls(ids, sequence, offsets, lengths, encode_sequence(sequence))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @cached_property
+    def text(self):
+        '''The concatenated sequence as a uint8 array of ascii codes.'''
+        return np.frombuffer(self.sequence.encode("ascii", errors="replace"), dtype=np.uint8)
+
+    def protein_sequence(self, index):
+        start = self.offsets[index]
+        return self.sequence[start:start + self.lengths[index]]
+
+    def find(self, protein, sequence):
+        '''0-based position of the first occurrence of a peptide in a protein, -1 if it does not occur.'''
+
+        if not sequence:
+            return -1
+        start = int(self.offsets[protein])
+        position = self.sequence.find(sequence, start, start + int(self.lengths[protein]))
+        return position - start if position >= 0 else -1
+
+    def protein_index(self, positions):
+        '''Index of the protein containing each position of the concatenated sequence.'''
+        return np.searchsorted(self.offsets, positions, side="right") - 1
+
+    def protein_indices(self, ids):
+        '''Index of the protein with each id, -1 for unknown ids. Duplicated ids refer to their first protein.'''
+
+        indices = pd.Series(np.arange(len(self.ids), dtype=np.int64), index=self.ids)
+        indices = indices[~indices.index.duplicated()]
+        return indices.reindex(ids).fillna(-1).to_numpy(dtype=np.int64)
+
+    def contains_at(self, proteins, offsets, sequences):
+        '''
+        Check whether peptides occur at the given positions.
+
+        args:
+            proteins: Index of the protein of each peptide, -1 for none.
+            offsets: 0-based start position of each peptide in its protein.
+            sequences: List of peptide sequences.
+
+        returns:
+            np.ndarray: True where the protein substring equals the peptide.
+        '''
+
+        proteins = np.asarray(proteins, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+
+        known = proteins >= 0
+        valid = known & (lengths > 0) & (offsets >= 0)
+        valid[known] &= offsets[known] + lengths[known] <= self.lengths[proteins[known]]
+
+        # compare all residues of the valid peptides at once
+        checked = np.where(valid, lengths, 0)
+        peptide = np.repeat(np.arange(len(sequences)), checked)
+        step = np.arange(len(peptide)) - np.repeat(np.cumsum(checked) - checked, checked)
+        starts = np.cumsum(lengths) - lengths
+        residues = np.frombuffer("".join(sequences).encode("ascii", errors="replace"), dtype=np.uint8)
+
+        text_positions = self.offsets[proteins[peptide]] + offsets[peptide] + step
+        mismatches = np.bincount(peptide[self.text[text_positions] != residues[starts[peptide] + step]], minlength=len(sequences))
+        return valid & (mismatches == 0)
+
+    def cleavage_windows(self, proteins, positions):
+        '''
+        Gather the residues P4 to P4' around cleavage positions.
+
+        args:
+            proteins: Index of the protein of each cleavage, -1 for none.
+            positions: 0-based position of the residue following each cleaved bond.
+
+        returns:
+            np.ndarray: (n, 8) uint8 array of amino acid indices, positions outside the protein are X.
+        '''
+
+        proteins = np.asarray(proteins, dtype=np.int64)
+        local = np.asarray(positions, dtype=np.int64)[:, None] + np.arange(-4, 4)
+        # protein -1 gets length 0, this also holds for an empty proteome
+        lengths = np.append(self.lengths, 0)[proteins]
+        offsets = np.append(self.offsets, 0)[proteins]
+        inside = (local >= 0) & (local < lengths[:, None])
+
+        windows = np.full(local.shape, aa_to_idx["X"], dtype=np.uint8)
+        windows[inside] = self.encoded[(offsets[:, None] + local)[inside]]
+        return windows
+
+
+@dataclass
+class HitTable:
+    '''
+    Occurrences of peptides in a proteome, one row per hit.
+
+    peptides: Index of the peptide in the list of mapped sequences.
+    proteins: Index of the protein in the proteome.
+    offsets: 0-based start position of the peptide in the protein.
+    '''
+
+    peptides: np.ndarray
+    proteins: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def from_lists(cls, peptides, proteins, offsets):
+        return cls(
+            np.asarray(peptides, dtype=np.int64),
+            np.asarray(proteins, dtype=np.int32),
+            np.asarray(offsets, dtype=np.int64),
+        )
+
+    def __len__(self):
+        return len(self.peptides)
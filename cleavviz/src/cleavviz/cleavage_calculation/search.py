@@ -0,0 +1,75 @@
+from collections import defaultdict
+import numpy as np
+
+NGRAM = 3
+
+class SearchIndex:
+    '''
+    Case-insensitive autocomplete over a fixed list of names.
+
+    Every name is indexed by the trigrams of its lowercase form, so a query only checks the names
+    that contain all of its trigrams. Matches are ranked exact, prefix, then substring and keep
+    the order of the list within each rank.
+    '''
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.lowercase = [str(item).lower() for item in self.items]
+
+        postings = defaultdict(list)
+        for i, name in enumerate(self.lowercase):
+            for ngram in {name[j:j + NGRAM] for j in range(len(name) - NGRAM + 1)}:
+                postings[ngram].append(i)
+        self.postings = {ngram: np.array(ids, dtype=np.int32) for ngram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.items)
+
+    def candidates(self, query):
+        '''Indices of the names that can contain the lowercase query, in list order.'''
+
+        if len(query) < NGRAM:
+            return range(len(self.items))
+
+        ngrams = {query[j:j + NGRAM] for j in range(len(query) - NGRAM + 1)}
+        if not ngrams <= self.postings.keys():
+            return []
+
+        # intersect the shortest posting lists first
+        ids = None
+        for postings in sorted((self.postings[ngram] for ngram in ngrams), key=len):
+            ids = postings if ids is None else np.intersect1d(ids, postings, assume_unique=True)
+            if len(ids) == 0:
+                break
+        return ids.tolist()
+
+    def search(self, query, limit=None, offset=0):
+        '''
+        Find all names containing a query, ignoring case.
+
+        args:
+            query: Search string, None or "" matches every name.
+            limit: Maximum number of names to return, None for all.
+            offset: Number of ranked matches to skip.
+
+        returns:
+            List of matching names, ranked exact, prefix, then substring matches.
+        '''
+
+        stop = None if limit is None else offset + limit
+        if not query:
+            return self.items[offset:stop]
+
+        query = query.lower()
+        ranked = ([], [], [])
+        for i in self.candidates(query):
+            name = self.lowercase[i]
+            if name == query:
+                ranked[0].append(i)
+            elif name.startswith(query):
+                ranked[1].append(i)
+            elif query in name:
+                ranked[2].append(i)
+
+        ids = ranked[0] + ranked[1] + ranked[2]
+        return [self.items[i] for i in ids[offset:stop]]
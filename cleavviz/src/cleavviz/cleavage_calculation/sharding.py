@@ -0,0 +1,134 @@
+import os
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+# proteomes are only split if every shard gets at least this many residues
+MIN_SHARD_RESIDUES = 1 << 20
+
+def resolve_workers(n_workers):
+    '''
+    Number of worker processes to use.
+
+    Work runs in-process unless parallelism is asked for. The environment variable
+    CLEAVVIZ_MAX_WORKERS sets the number of workers used for None and caps explicit values on
+    shared hosts, None means one worker if it is not set.
+    '''
+    max_workers = os.environ.get("CLEAVVIZ_MAX_WORKERS")
+    if n_workers is None:
+        n_workers = max_workers or 1
+    elif max_workers:
+        n_workers = min(int(n_workers), int(max_workers))
+    return max(1, int(n_workers))
+
+def protein_shards(proteome, n_workers):
+    '''
+    Split the proteins of a proteome into contiguous ranges holding about the same number of residues.
+
+    args:
+        proteome: Concatenated and encoded protein sequences.
+        n_workers: Number of worker processes, None for CLEAVVIZ_MAX_WORKERS, see resolve_workers.
+
+    returns:
+        List of (first, stop) protein ranges, in protein order.
+    '''
+
+    total = int(proteome.lengths.sum())
+    n_shards = max(1, min(resolve_workers(n_workers), len(proteome), total // MIN_SHARD_RESIDUES))
+
+    cumulative = np.cumsum(proteome.lengths)
+    bounds = np.searchsorted(cumulative, np.arange(1, n_shards) * (total / n_shards), side="right")
+    bounds = np.unique(np.concatenate([[0], bounds, [len(proteome)]]))
+    # an empty proteome still gets one empty shard
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist())) or [(0, len(proteome))]
+
+def map_shards(function, shards, n_workers):
+    '''
+    Run function(*shard) for every shard, in a process pool if there are at least two shards.
+
+    args:
+        function: Module level function, so it can be sent to the worker processes.
+        shards: List of argument tuples.
+        n_workers: Number of worker processes, None for CLEAVVIZ_MAX_WORKERS, see resolve_workers.
+
+    returns:
+        List of results in the order of the shards.
+    '''
+
+    if len(shards) < 2:
+        return [function(*shard) for shard in shards]
+    with ProcessPoolExecutor(max_workers=min(resolve_workers(n_workers), len(shards))) as pool:
+        return list(pool.map(function, *zip(*shards)))
+
+def merge_sorted_shards(keys, *values):
+    '''
+    Merge shards that are each sorted by key into one sorted array.
+
+    The shards are given in protein order and the sort is stable, so entries with equal keys
+    stay ordered by protein exactly like a sort over the whole proteome. Concatenated sorted runs
+    are merged by the stable sort in little more than linear time.
+
+    args:
+        keys: List of sorted key arrays, one per shard.
+        values: Lists of arrays aligned with the keys.
+
+    returns:
+        Tuple of the merged keys followed by the merged values.
+    '''
+
+    if len(keys) == 1:
+        return (keys[0], *(value[0] for value in values))
+
+    keys = np.concatenate(keys)
+    order = np.argsort(keys, kind="stable")
+    return (keys[order], *(np.concatenate(value)[order] for value in values))
+
+@contextmanager
+def shared_arrays(arrays):
+    '''
+    Publish arrays in shared memory for the lifetime of the context.
+
+    args:
+        arrays: Dictionary of numpy arrays.
+
+    returns:
+        Dictionary with the (shared memory name, shape, dtype) of each array, see attach_shared_arrays.
+    '''
+
+    blocks = []
+    try:
+        spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(1, array.nbytes))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            spec[name] = (block.name, array.shape, array.dtype.str)
+        yield spec
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+def attach_shared_arrays(spec):
+    '''
+    Attach to arrays published by shared_arrays, without copying them.
+
+    Meant for the worker processes of the publishing process, they share its resource tracker so
+    the blocks are only unlinked by the publisher.
+
+    returns:
+        arrays: Dictionary of read-only numpy arrays backed by the shared memory.
+        blocks: Shared memory handles, they have to be kept alive as long as the arrays are used.
+    '''
+
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in spec.items():
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays, blocks
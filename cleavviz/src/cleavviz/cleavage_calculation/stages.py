@@ -0,0 +1,48 @@
+from collections import Counter
+
+class StageGraph:
+    '''
+    Tracks which stages of a calculation are stale.
+
+    Every stage lists the stages it is computed from. Invalidating a stage marks it and all stages
+    downstream of it stale, so only those have to be computed again. All stages start stale.
+    '''
+
+    def __init__(self, dependencies):
+        '''
+        args:
+            dependencies: Dictionary with the stages each stage is computed from, in topological order.
+        '''
+
+        self.order = list(dependencies)
+        self.dependents = {stage: [] for stage in self.order}
+        for stage, upstream in dependencies.items():
+            for dependency in upstream:
+                self.dependents[dependency].append(stage)
+
+        self.stale = set(self.order)
+        self.runs = Counter()
+
+    def invalidate(self, stage):
+        '''Mark a stage and everything computed from it stale.'''
+        pending = [stage]
+        while pending:
+            stage = pending.pop()
+            self.stale.add(stage)
+            pending.extend(self.dependents[stage])
+
+    def is_stale(self, stage):
+        '''Whether a stage has to be computed again.'''
+        return stage in self.stale
+
+    def pending(self):
+        '''Stale stages in topological order.'''
+        return [stage for stage in self.order if stage in self.stale]
+
+    def done(self, stage):
+        '''Mark a stage as computed.'''
+        self.stale.discard(stage)
+        self.runs[stage] += 1
+
+    def stats(self):
+        return {stage: self.runs[stage] for stage in self.order}
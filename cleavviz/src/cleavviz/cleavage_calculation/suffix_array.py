@@ -0,0 +1,170 @@
+import numpy as np
+from .proteome import HitTable
+from .sharding import protein_shards, map_shards, merge_sorted_shards
+
+def _sorted_suffixes(codes, start, n_suffixes, depth, bits):
+    '''
+    Sort the suffixes starting in a shard of the text by their packed prefix.
+
+    args:
+        codes: Codes of the shard followed by the next depth - 1 codes of the text.
+        start: Position of the shard in the text.
+        n_suffixes: Number of suffixes starting in the shard.
+        depth: Number of codes packed into each prefix.
+        bits: Number of bits per code.
+
+    returns:
+        Sorted prefixes and the start position of each suffix.
+    '''
+
+    prefixes = SuffixArray._pack(codes, np.arange(n_suffixes, dtype=np.int64), depth, bits)
+    order = np.argsort(prefixes, kind="stable")
+    return prefixes[order], order + start
+
+
+class SuffixArray:
+    '''
+    Suffix array over all proteins of a proteome.
+
+    The suffixes are sorted by their first `depth` residues, which are packed into a single 64-bit
+    key per suffix. A peptide is located with a binary search over these keys, residues beyond
+    the packed prefix are verified against the proteome afterwards.
+    '''
+
+    def __init__(self, codes, lookup, bits, suffixes, prefixes):
+        self.codes = codes
+        self.lookup = lookup
+        self.bits = bits
+        self.depth = 63 // bits
+        self.suffixes = suffixes
+        self.prefixes = prefixes
+
+    @classmethod
+    def from_proteome(cls, proteome, n_workers=1):
+        '''
+        Sort all suffixes of a proteome.
+
+        Large proteomes are split into shards of whole proteins, the suffixes of every shard are
+        sorted in parallel worker processes and the sorted shards are merged.
+
+        args:
+            proteome: Concatenated and encoded protein sequences.
+            n_workers: Number of worker processes, None for CLEAVVIZ_MAX_WORKERS, see sharding.resolve_workers.
+
+        returns:
+            SuffixArray: Suffix array over the concatenated sequence.
+        '''
+
+        text = proteome.text
+
+        # rank preserving codes, 0 is reserved for positions past the end of the text
+        symbols = np.flatnonzero(np.bincount(text, minlength=256))
+        lookup = np.zeros(256, dtype=np.uint8)
+        lookup[symbols] = np.arange(1, len(symbols) + 1)
+        bits = max(1, int(len(symbols)).bit_length())
+        codes = lookup[text]
+        depth = 63 // bits
+
+        # a shard also needs the residues following its last suffix to pack the prefixes
+        shards = []
+        starts = np.append(proteome.offsets, len(codes))
+        bounds = [int(starts[first]) for first, _ in protein_shards(proteome, n_workers)] + [len(codes)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            shards.append((codes[start:stop + depth - 1], start, stop - start, depth, bits))
+
+        prefixes, suffixes = merge_sorted_shards(*zip(*map_shards(_sorted_suffixes, shards, n_workers)))
+        index_dtype = np.int32 if len(codes) < np.iinfo(np.int32).max else np.int64
+
+        return cls(codes, lookup, bits, suffixes.astype(index_dtype), prefixes)
+
+    def to_arrays(self):
+        '''Arrays needed to restore the suffix array with from_arrays.'''
+        return {
+            "codes": self.codes,
+            "lookup": self.lookup,
+            "bits": np.array(self.bits),
+            "suffixes": self.suffixes,
+            "prefixes": self.prefixes,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, proteome):
+        return cls(arrays["codes"], arrays["lookup"], int(arrays["bits"]), arrays["suffixes"], arrays["prefixes"])
+
+    @staticmethod
+    def _pack(codes, starts, depth, bits):
+        '''Pack `depth` codes starting at each of `starts` into one integer, padded with 0.'''
+
+        keys = np.zeros(len(starts), dtype=np.int64)
+        for j in range(depth):
+            positions = starts + j
+            inside = positions < len(codes)
+            keys <<= bits
+            keys[inside] |= codes[positions[inside]]
+        return keys
+
+    def _encode(self, sequences):
+        '''Encode peptides with the codes of the suffix array, unknown residues are encoded as 0.'''
+
+        lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+        text = np.frombuffer("".join(sequences).encode("ascii", errors="replace"), dtype=np.uint8)
+        return self.lookup[text], lengths, np.cumsum(lengths) - lengths
+
+    def map_peptides(self, sequences, proteome):
+        '''
+        Find every occurrence of every peptide.
+
+        args:
+            sequences: List of unique peptide sequences.
+            proteome: Proteome the suffix array was built from.
+
+        returns:
+            HitTable: One row per occurrence, ordered by peptide, protein and offset.
+        '''
+
+        codes, lengths, starts = self._encode(sequences)
+        unknown_residues = np.bincount(np.repeat(np.arange(len(sequences)), lengths)[codes == 0], minlength=len(sequences))
+        known = (unknown_residues == 0) & (lengths > 0)
+
+        # binary search for the range of suffixes sharing the packed prefix of each peptide
+        prefix_lengths = np.minimum(lengths, self.depth)
+        low = self._pack_prefix(codes, starts, prefix_lengths)
+        padding = (self.depth - prefix_lengths) * self.bits
+        high = low | ((np.int64(1) << padding) - 1)
+        left = np.searchsorted(self.prefixes, low, side="left")
+        right = np.searchsorted(self.prefixes, high, side="right")
+        counts = np.where(known, right - left, 0)
+
+        peptides = np.repeat(np.arange(len(sequences), dtype=np.int64), counts)
+        first = np.cumsum(counts) - counts
+        positions = self.suffixes[np.repeat(left, counts) + np.arange(counts.sum()) - np.repeat(first, counts)]
+        positions = positions.astype(np.int64)
+
+        # verify residues that did not fit into the packed prefix
+        for j in range(self.depth, int(lengths.max(initial=0))):
+            check = lengths[peptides] > j
+            if not check.any():
+                break
+            text_positions = positions[check] + j
+            matches = np.zeros(len(text_positions), dtype=bool)
+            inside = text_positions < len(self.codes)
+            matches[inside] = self.codes[text_positions[inside]] == codes[starts[peptides[check]][inside] + j]
+            keep = np.ones(len(peptides), dtype=bool)
+            keep[check] = matches
+            peptides, positions = peptides[keep], positions[keep]
+
+        proteins = proteome.protein_index(positions)
+        offsets = positions - proteome.offsets[proteins]
+        order = np.lexsort((offsets, proteins, peptides))
+
+        return HitTable(peptides[order], proteins[order].astype(np.int32), offsets[order])
+
+    def _pack_prefix(self, codes, starts, prefix_lengths):
+        '''Pack the first prefix_lengths codes of each peptide, left aligned within depth codes.'''
+
+        keys = np.zeros(len(starts), dtype=np.int64)
+        for j in range(self.depth):
+            inside = prefix_lengths > j
+            keys <<= self.bits
+            keys[inside] |= codes[starts[inside] + j]
+        return keys
@@ -1,9 +1,11 @@
 import logging
 import math
 
+import numpy as np
 import pandas as pd
 
 from .constants import AggregationMethod, PeptideDF
+from .cleavage_calculation.proteome import Proteome
 
 
 logger = logging.getLogger(__name__)
@@ -32,35 +34,65 @@ def find_peptide_position(protein_seq, peptide_seq):
     end = start + len(peptide_seq)
     return (start + 1, end)
 
+def verify_peptide_positions(protein_sequence:str, peptide_sequences:list, starts) -> np.ndarray:
+    """
+    Check that the protein substring at each 1-based start position equals the peptide.
+    Starts are numbers, NaN where the position is unknown.
+    Returns a boolean array, False for missing, fractional or out of range positions.
+    """
+    starts = np.asarray(starts, dtype=float)
+    known = np.isfinite(starts) & (starts == np.floor(starts))
+    proteome = Proteome.from_fasta(pd.DataFrame({"id": [None], "sequence": [protein_sequence]}))
+    return proteome.contains_at(np.where(known, 0, -1), np.where(known, starts, 0).astype(np.int64) - 1, peptide_sequences)
+
 def calculate_count_sum(protein_sequence:str, peptides: pd.DataFrame, aggregation_method:AggregationMethod) -> pd.DataFrame:
     """
     Calculate the count and sum of intensities of peptites along protein.
+    Peptide positions are taken from the Start column where it matches the protein sequence,
+    all other peptides are searched in the sequence.
     Returns a tuple of count and intensity.
     """
-    grouped_peptides: pd.DataFrame
-    if aggregation_method == AggregationMethod.SUM:
-        grouped_peptides = peptides.groupby([PeptideDF.PEPTIDE_SEQUENCE])[PeptideDF.INTENSITY].sum().reset_index()
-    elif aggregation_method == AggregationMethod.MEDIAN:
-        grouped_peptides = peptides.groupby([PeptideDF.PEPTIDE_SEQUENCE])[PeptideDF.INTENSITY].median().reset_index()
-    elif aggregation_method == AggregationMethod.MEAN:
-        grouped_peptides = peptides.groupby([PeptideDF.PEPTIDE_SEQUENCE])[PeptideDF.INTENSITY].mean().reset_index()
-    else:
+    aggregations = {
+        AggregationMethod.SUM: "sum",
+        AggregationMethod.MEDIAN: "median",
+        AggregationMethod.MEAN: "mean",
+    }
+    if aggregation_method not in aggregations:
         raise ValueError(f"Unknown group method: {aggregation_method}")
 
+    columns = {PeptideDF.INTENSITY: aggregations[aggregation_method]}
+    if PeptideDF.START in peptides.columns:
+        columns[PeptideDF.START] = "first"
+    grouped_peptides = peptides.groupby([PeptideDF.PEPTIDE_SEQUENCE]).agg(columns).reset_index()
+
+    sequences = grouped_peptides[PeptideDF.PEPTIDE_SEQUENCE].tolist()
+    starts = [None] * len(sequences)
+    ends = [None] * len(sequences)
+    verified = np.zeros(len(sequences), dtype=bool)
+    if PeptideDF.START in grouped_peptides.columns and not pd.isna(protein_sequence):
+        # Start may be read as text, e.g. "12.0", positions that are no number are searched
+        positions = pd.to_numeric(grouped_peptides[PeptideDF.START], errors="coerce").to_numpy(dtype=float)
+        verified = verify_peptide_positions(protein_sequence, sequences, positions)
+
+    for i, sequence in enumerate(sequences):
+        if verified[i]:
+            starts[i] = int(positions[i])
+            ends[i] = starts[i] + len(sequence) - 1
+        else:
+            starts[i], ends[i] = find_peptide_position(protein_sequence, sequence)
+
     proteinlength = len(protein_sequence)
     count = [0] * proteinlength
     intensity = [0] * proteinlength
 
-    for _, peptide in grouped_peptides.iterrows():
-        start, end = find_peptide_position(protein_sequence, peptide[PeptideDF.PEPTIDE_SEQUENCE])
-        if start is None:
+    for start, end, peptide_intensity in zip(starts, ends, grouped_peptides[PeptideDF.INTENSITY]):
+        if start is None or math.isnan(peptide_intensity):
             continue
-        for i in range(start-1, end):
-            if not math.isnan(peptide[PeptideDF.INTENSITY]):
-                peptide_intensity = int(peptide[PeptideDF.INTENSITY])
-                if peptide_intensity > 0:
-                    intensity[i] += peptide_intensity
-                    count[i] += 1
+        peptide_intensity = int(peptide_intensity)
+        if peptide_intensity > 0:
+            for i in range(start-1, end):
+                intensity[i] += peptide_intensity
+                count[i] += 1
 
     return count, intensity
 
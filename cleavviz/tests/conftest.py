@@ -0,0 +1,39 @@
+import pytest
+from src.cleavviz.cleavage_calculation.cleavage_enrichment_analysis import CleavageEnrichmentAnalysis
+from src.cleavviz.cleavage_calculation.preprocessing import get_enzyme_df
+from src.cleavviz.cleavage_calculation.enzyme_models import EnzymeModel
+from src.cleavviz.cleavage_calculation.constants import amino_acids
+
+@pytest.fixture
+def make_analysis():
+    '''Factory of analyses over a fasta file that bypass the on-disk index cache.'''
+
+    def make(fasta, peptide_df=None, **settings):
+        ea = CleavageEnrichmentAnalysis()
+        ea.index_cache = None
+        for key, value in settings.items():
+            setattr(ea, key, value)
+        ea.set_fasta(fasta)
+        if peptide_df is not None:
+            ea.set_peptides(peptide_df)
+        return ea
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def enzyme_df():
+    enzyme_df, _, _ = get_enzyme_df()
+    return enzyme_df
+
+
+@pytest.fixture(scope="session")
+def background():
+    '''Amino acid counts that differ per amino acid.'''
+    return {aa: 100 + 7 * i for i, aa in enumerate(amino_acids)}
+
+
+@pytest.fixture(scope="session")
+def enzyme_model(enzyme_df, background):
+    '''Model of all enzymes of the database.'''
+    return EnzymeModel.from_enzymes(enzyme_df, background)
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from src.cleavviz.cleavage_calculation.candidate_matcher import CandidateMatcher
+from src.cleavviz.cleavage_calculation.regex_trie import RegexTrie
+from src.cleavviz.cleavage_calculation.enzyme_models import EnzymeModel
+from src.cleavviz.cleavage_calculation import matching
+from src.cleavviz.cleavage_calculation.matching import find_top_matches, calculate_pssm_score
+from src.cleavviz.cleavage_calculation.helper import decode_windows
+from src.cleavviz.cleavage_calculation.constants import alphabet, amino_acids
+
+def test_candidate_matcher_matches_regex_trie(enzyme_model):
+    regexes = enzyme_model.regexes
+
+    trie = RegexTrie(alphabet)
+    for code in regexes:
+        trie.insert(regexes[code], code)
+    matcher = CandidateMatcher(regexes)
+
+    # mostly common amino acids so that windows match, some X
+    rng = np.random.default_rng(0)
+    windows = rng.choice([0, 1, 8, 11, 14, 15, 16, 20], size=(2000, 8), p=[0.2, 0.15, 0.15, 0.15, 0.1, 0.1, 0.14, 0.01]).astype(np.uint8)
+
+    candidates = matcher.match_mask(windows)
+    n_matched = 0
+    for word, mask in zip(decode_windows(windows), candidates):
+        expected = trie.match(word)
+        assert sorted(np.array(matcher.codes)[mask]) == sorted(expected)
+        n_matched += len(expected) > 0
+    assert n_matched > 100
+
+def test_find_best_match_in_chunks(enzyme_model):
+
+    rng = np.random.default_rng(1)
+    windows = rng.integers(0, 21, size=(3000, 8)).astype(np.uint8)
+
+    expected = []
+    for row, (window, mask) in enumerate(zip(windows, enzyme_model.matcher.match_mask(windows))):
+        scores = {enzyme_model.matcher.codes[i]: calculate_pssm_score(enzyme_model.pssms[enzyme_model.matcher.codes[i]], window) for i in np.flatnonzero(mask)}
+        if scores:
+            expected.append((row, max(scores, key=scores.get)))
+
+    rows, codes, _, log_p_values = find_top_matches(windows, enzyme_model.matcher, enzyme_model.pssms, enzyme_model.null, k=1, max_chunk_bytes=1 << 16)
+    assert list(zip(rows.tolist(), codes.tolist())) == expected
+    assert len(expected) < len(windows)
+    assert np.all(log_p_values <= 0)
+
+def test_find_top_matches(enzyme_model):
+
+    rng = np.random.default_rng(2)
+    windows = rng.integers(0, 20, size=(500, 8)).astype(np.uint8)
+    # equal scores at the k-th place must be ranked by enzyme order
+    windows[:50] = windows[0]
+
+    expected = []
+    for row, (window, mask) in enumerate(zip(windows, enzyme_model.matcher.match_mask(windows))):
+        candidates = [(-calculate_pssm_score(enzyme_model.pssms[enzyme_model.matcher.codes[i]], window), i) for i in np.flatnonzero(mask)]
+        expected += [(row, enzyme_model.matcher.codes[i]) for _, i in sorted(candidates)[:3]]
+
+    rows, codes, scores, log_p_values = find_top_matches(windows, enzyme_model.matcher, enzyme_model.pssms, enzyme_model.null, k=3, max_chunk_bytes=1 << 14)
+    assert list(zip(rows.tolist(), codes.tolist())) == expected
+    assert np.all(np.diff(scores)[np.diff(rows) == 0] <= 0)
+    assert np.all(log_p_values <= 0)
+
+    with pytest.raises(ValueError):
+        find_top_matches(windows, enzyme_model.matcher, enzyme_model.pssms, enzyme_model.null, k=0)
+
+
+def test_exact_null_distribution(enzyme_df, background):
+    model = EnzymeModel.from_enzymes(enzyme_df.iloc[:40], background)
+    null = model.null
+
+    # sample windows from the background and compare with the empirical survival function
+    probabilities = np.array([background[aa] for aa in amino_acids], dtype=float)
+    rng = np.random.default_rng(0)
+    windows = rng.choice(len(amino_acids), size=(100000, 8), p=probabilities / probabilities.sum())
+    enzymes = np.full(len(windows), 3)
+
+    scores = null.bins[3, np.arange(8), windows].sum(axis=1)
+    empirical = 1 - np.searchsorted(np.sort(scores), scores[:200]) / len(scores)
+    assert np.allclose(np.exp(null.log_p_values(enzymes[:200], windows[:200])), empirical, atol=0.01)
+
+    # the best possible window of an enzyme has the probability of that window
+    best = null.bins[3, :, :20].argmax(axis=1)
+    assert np.exp(null.log_p_values([3], best[None])[0]) >= np.prod(probabilities[best] / probabilities.sum()) * (1 - 1e-9)
+
+def test_parallel_matching_matches_serial(monkeypatch, enzyme_df, background):
+    monkeypatch.setattr(matching, "MIN_PARALLEL_WINDOWS", 100)
+    model = EnzymeModel.from_enzymes(enzyme_df.iloc[::5], background)
+
+    windows = np.random.default_rng(2).integers(0, 21, size=(1000, 8)).astype(np.uint8)
+    serial = find_top_matches(windows, model.matcher, model.pssms, model.null, k=1)
+    parallel = find_top_matches(windows, model.matcher, model.pssms, model.null, k=1, n_workers=3)
+    for a, b in zip(serial, parallel):
+        assert a.tolist() == b.tolist()
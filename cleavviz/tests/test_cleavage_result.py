@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import pandas as pd
+from src.cleavviz.cleavage_calculation.cleavage_result import CleavageResult
+from src.cleavviz.cleavage_calculation.postprocessing import accumulate_results
+from src.cleavviz.cleavage_calculation.cleavage_enrichment_analysis import CleavageEnrichmentAnalysis
+
+def cleavage_result():
+    enzymes = pd.Categorical(["Trypsin", "Trypsin", "Lys-C", "unspecified cleavage"])
+    return CleavageResult(
+        windows=np.array([[0] * 8, [1] * 8, [0] * 8, [20] * 8], dtype=np.uint8),
+        proteins=pd.Categorical(["P1", "P1", "P2", None]),
+        enzymes=enzymes,
+        positions=np.array([3, 10, 5, -1]),
+        p_values=np.array([0.1, 0.3, 0.2, np.nan]),
+        log_p_values=np.log([0.1, 0.3, 0.2, np.nan]),
+        sample_names=["A", "B"],
+        sample_offsets=np.array([0, 2, 3, 4, 5]),
+        sample_ids=np.array([0, 1, 1, 0, 1], dtype=np.int32),
+        candidate_offsets=np.array([0, 2, 3, 4, 4]),
+        candidate_enzymes=pd.Categorical(["Trypsin", "Lys-C", "Trypsin", "Lys-C"], categories=enzymes.categories),
+        candidate_scores=np.array([3.0, 2.0, 1.0, 4.0]),
+        candidate_log_p_values=np.log([0.1, 0.4, 0.3, 0.2]),
+    )
+
+def test_take_and_samples():
+    result = cleavage_result()
+
+    assert result.in_samples(["B"]).tolist() == [True, True, False, True]
+    subset = result.take([1, 0])
+    assert subset.to_dataframe()["sample"].tolist() == [["B"], ["A", "B"]]
+    assert subset.to_dataframe()["cleavage_site"].tolist() == ["RRRRRRRR", "AAAAAAAA"]
+    assert result.to_dataframe()["position"].tolist() == [3, 10, 5, pd.NA]
+
+def test_accumulate_results():
+    summary = accumulate_results(cleavage_result(), "P1", {"sample": ["A", "B"]})
+
+    assert list(summary) == ["Trypsin"]
+    assert summary["Trypsin"]["positions"] == [3, 10]
+    assert summary["Trypsin"]["total_count"] == 2
+    assert np.isclose(summary["Trypsin"]["p_value"], 0.2)
+    assert summary["Trypsin"]["motif"].loc[1, "A"] == 0.5
+    assert summary["Trypsin"]["motif"].columns.tolist() == ["A", "R"]
+    assert accumulate_results(cleavage_result(), "P1", {"sample": ["C"]}) == {}
+
+def test_fractional_assignment():
+    result = cleavage_result()
+    assert np.allclose(result.candidate_weights(), [2 / 3, 1 / 3, 1, 1])
+    assert result.take([2, 0]).candidate_table()["enzyme"].tolist() == ["Lys-C", "Trypsin", "Lys-C"]
+
+    summary = accumulate_results(result, "P1", None, assignment="fractional")
+    assert list(summary) == ["Trypsin", "Lys-C"]
+    assert np.isclose(summary["Trypsin"]["total_count"], 5 / 3)
+    assert np.isclose(summary["Lys-C"]["total_count"], 1 / 3)
+    assert np.isclose(summary["Trypsin"]["p_value"], (2 / 3 * 0.1 + 0.3) / (5 / 3))
+    assert summary["Lys-C"]["positions"] == [3]
+
+def test_sort_by_protein():
+    result = cleavage_result().take([2, 3, 0, 1])
+    assert result.protein_rows("P1").tolist() == [False, False, True, True]
+
+    ordered = result.sort_by_protein()
+    assert ordered.protein_offsets.tolist() == [0, 2, 3]
+    assert ordered.protein_rows("P1") == slice(0, 2)
+    assert ordered.protein_rows("P3") == slice(0, 0)
+    assert ordered.positions[ordered.protein_rows("P1")].tolist() == [3, 10]
+    summary = accumulate_results(ordered, "P1", {"sample": ["B"]})
+    assert summary["Trypsin"]["positions"] == [3, 10]
+    pd.testing.assert_frame_equal(summary["Trypsin"]["motif"], accumulate_results(result, "P1", {"sample": ["B"]})["Trypsin"]["motif"])
+
+def test_invalid_settings_are_rejected():
+    ea = CleavageEnrichmentAnalysis()
+    for top_k in [0, -1, 1.5, True]:
+        with pytest.raises(ValueError):
+            ea.top_k = top_k
+    with pytest.raises(ValueError):
+        ea.assignment = "weighted"
+    with pytest.raises(ValueError):
+        cleavage_result().assignments("weighted")
+
+    ea.top_k = 2
+    ea.assignment = "fractional"
+    assert (ea.top_k, ea.assignment) == (2, "fractional")
@@ -0,0 +1,34 @@
+from pathlib import Path
+import numpy as np
+from src.cleavviz.cleavage_calculation.enzyme_db import build_enzyme_db, load_enzyme_db, SOURCE_FILE
+from src.cleavviz.cleavage_calculation.constants import base_enzyme_codes
+
+PACKAGE = Path(__file__).parents[1] / "src" / "cleavviz" / "cleavage_calculation"
+
+def test_enzyme_db_is_up_to_date(tmp_path):
+    build_enzyme_db(PACKAGE / SOURCE_FILE, tmp_path)
+    enzyme_db = load_enzyme_db()
+
+    for name in ("counts", "codes", "names", "species"):
+        assert np.array_equal(np.load(tmp_path / f"{name}.npy"), getattr(enzyme_db, name))
+
+def test_enzyme_db_contains_p_variants():
+    enzyme_db = load_enzyme_db()
+    codes = enzyme_db.codes.tolist()
+
+    for code in base_enzyme_codes:
+        assert code in codes
+        if code[-2:] == "/P":
+            assert np.array_equal(enzyme_db.counts[codes.index(code)], enzyme_db.counts[codes.index(code[:-2])])
+
+def test_enzyme_selection():
+    enzyme_db = load_enzyme_db()
+    selector = enzyme_db.selector
+    species = [s for s in dict.fromkeys(enzyme_db.species.tolist()) if s][:3]
+
+    expected = np.flatnonzero(np.isin(enzyme_db.species, species) | np.isin(enzyme_db.codes, list(base_enzyme_codes)))
+    assert np.array_equal(selector.select(True, species, None), expected)
+    assert np.array_equal(selector.select(False, species[0], []), np.flatnonzero(enzyme_db.species == species[0]))
+    assert np.array_equal(selector.select(False, None, [enzyme_db.names[5]]), np.flatnonzero(enzyme_db.names == enzyme_db.names[5]))
+    assert len(selector.select(False, [], None)) == len(enzyme_db)
+    assert len(selector.select(False, ["unknown species"], None)) == 0
@@ -0,0 +1,37 @@
+import numpy as np
+from src.cleavviz.cleavage_calculation.memo import Memo, MatchMemo
+
+def test_memo_evicts_least_recently_used_entries():
+    memo = Memo(max_entries=3)
+    memo.validate("fasta")
+    memo.update(["a", "b", "c"], [1, 2, 3])
+
+    results, missing = memo.split(["a", "d", "d"])
+    assert (results, missing) == ([1, None, None], ["d"])
+    memo.update(missing, [4])
+    assert list(memo.entries) == ["c", "a", "d"]
+    assert (memo.hits, memo.misses) == (2, 1)
+
+    # a new key drops all entries
+    memo.validate("other fasta")
+    assert len(memo) == 0
+
+def test_match_memo_stores_candidates_in_columns():
+    memo = MatchMemo(max_entries=3)
+    memo.validate("model")
+    missing = memo.missing(np.array([5, 9], dtype=np.uint64))
+    memo.insert(missing, [0, 2, 2], ["b", "a"], [3.0, 1.0], [-1.0, -0.5])
+    missing = memo.missing(np.array([2, 5, 7], dtype=np.uint64))
+    assert missing.tolist() == [2, 7]
+    memo.insert(missing, [0, 1, 2], ["a", "c"], [2.0, 4.0], [-0.7, -2.0])
+
+    offsets, enzymes, scores, log_p_values = memo.candidates(np.array([7, 5, 9, 2], dtype=np.uint64))
+    assert offsets.tolist() == [0, 1, 3, 3, 4]
+    assert memo.codes[enzymes].tolist() == ["c", "b", "a", "a"]
+    assert scores.tolist() == [4.0, 3.0, 1.0, 2.0]
+    assert log_p_values.tolist() == [-2.0, -1.0, -0.5, -0.7]
+
+    # 9 was not used in the last lookup
+    memo.evict()
+    assert memo.keys.tolist() == [2, 5, 7]
+    assert (memo.hits, memo.misses) == (1, 4)
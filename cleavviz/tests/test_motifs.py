@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from Bio import motifs
+from src.cleavviz.cleavage_calculation.motifs import get_count_tensor, calculate_log_frequencies, apply_background
+from src.cleavviz.cleavage_calculation.enzyme_db import load_enzyme_db
+from src.cleavviz.cleavage_calculation.enzyme_models import EnzymeModel, EnzymeModelCache
+from src.cleavviz.cleavage_calculation.constants import amino_acids, alphabet, site_columns
+
+def calculate_pssms(counts_by_code, background):
+    '''Biopython position specific scoring matrices of the enzymes, as the oracle of the vectorised PSSMs.'''
+
+    pssms = {}
+    for code, site_counts in counts_by_code.items():
+        m = motifs.Motif(counts={aa: list(site_counts[aa]) for aa in site_counts.columns}, alphabet=alphabet)
+        m.background = background
+        m.pseudocounts = 1
+        pssms[code] = np.array([[m.pssm[aa][i] for aa in alphabet] + [0] for i in range(len(site_columns))])
+    return pssms
+
+def test_pssm_tensor_matches_biopython(enzyme_df):
+    enzyme_df = enzyme_df.iloc[::10]
+    rng = np.random.default_rng(0)
+    background = {aa: int(count) for aa, count in zip(amino_acids, rng.integers(1, 10000, len(amino_acids)))}
+    background["X"] = 17
+
+    counts = get_count_tensor(enzyme_df)
+    counts_by_code = {code: pd.DataFrame(site_counts, index=site_columns, columns=amino_acids) for code, site_counts in zip(enzyme_df["code"], counts)}
+    expected = calculate_pssms(counts_by_code, background)
+
+    pssms = apply_background(calculate_log_frequencies(counts), background)
+    for code, pssm in zip(enzyme_df["code"], pssms):
+        np.testing.assert_allclose(pssm, expected[code], rtol=1e-12, atol=1e-12)
+
+def test_enzyme_model_cache_reuses_recent_selections(enzyme_df, background):
+    first, second, third = enzyme_df.iloc[:5], enzyme_df.iloc[5:10], enzyme_df.iloc[10:15]
+
+    cache = EnzymeModelCache(max_models=2)
+    model = cache.get(first, background)
+    cache.get(second, background)
+    assert cache.get(first.iloc[::-1], background) is model
+
+    # a different background needs a new model, least recently used models are evicted
+    selection = cache.get_selection(first)
+    assert cache.get(first, {**background, "A": 1}) is not model
+    assert cache.get_selection(first.iloc[::-1]) is selection
+    cache.get(third, background)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 4, 2)
+    assert cache.get(first, {**background, "A": 1}) is not None and cache.hits == 2
+    cache.get(second, background)
+    assert cache.misses == 5
+
+def test_frequency_store_gives_same_models(enzyme_df, background):
+    selection = enzyme_df[enzyme_df["code"].isin(["S01.151", "S01.151/P", "C14.003"]) | (enzyme_df.index % 50 == 0)]
+
+    expected = EnzymeModelCache().get(selection, background)
+    model = EnzymeModelCache(load_enzyme_db().log_frequencies).get(selection, background)
+
+    assert model.regexes == expected.regexes
+    for code in expected.pssms:
+        np.testing.assert_allclose(model.pssms[code], expected.pssms[code], rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(model.null.log_sf, expected.null.log_sf, rtol=1e-9)
+
+def test_changed_selection_reuses_score_distributions(enzyme_df, background):
+    cache = EnzymeModelCache()
+    cache.get(enzyme_df.iloc[:30], background)
+    model = cache.get(enzyme_df.iloc[20:40], background)
+
+    # only the enzymes that were not selected before get new distributions
+    assert cache.nulls.misses == len(cache.get(enzyme_df.iloc[:40], background).null) == len(cache.nulls)
+    expected = EnzymeModel.from_enzymes(enzyme_df.iloc[20:40], background)
+    for name in ["bins", "offsets", "starts", "log_sf"]:
+        np.testing.assert_array_equal(getattr(model.null, name), getattr(expected.null, name))
@@ -0,0 +1,292 @@
+import os
+import random
+import pytest
+from collections import defaultdict
+import pandas as pd
+from src.cleavviz.cleavage_calculation.proteome import Proteome
+from src.cleavviz.cleavage_calculation.kmer import KmerIndex, count_background
+from src.cleavviz.cleavage_calculation.suffix_array import SuffixArray
+from src.cleavviz.cleavage_calculation.aho_corasick import AhoCorasickMapper
+from src.cleavviz.cleavage_calculation.mapping import MAPPING_METHODS, build_peptide_index
+from src.cleavviz.cleavage_calculation.index_cache import IndexCache, fasta_digest
+from src.cleavviz.cleavage_calculation.preprocessing import get_cleavage_sites, get_claims
+from src.cleavviz.cleavage_calculation.constants import alphabet, alphabet_with_X, amino_acids
+from src.cleavviz.cleavage_calculation import sharding
+
+def random_fasta(n_proteins=50, seed=0):
+    rng = random.Random(seed)
+    sequences = ["".join(rng.choice(alphabet) for _ in range(rng.randint(3, 200))) for _ in range(n_proteins)]
+    # shared region and a non standard residue
+    sequences.append(sequences[0][5:40])
+    sequences.append("MKUWQPLSTKR")
+    return pd.DataFrame({"id": [f"P{i}" for i in range(len(sequences))], "sequence": sequences})
+
+def test_kmer_index_matches_dict_index():
+    fasta = random_fasta()
+    proteome = Proteome.from_fasta(fasta)
+    kmer_index = KmerIndex.from_proteome(proteome, k=6)
+
+    expected = defaultdict(list)
+    for protein in fasta.itertuples():
+        for i in range(len(protein.sequence) - 6 + 1):
+            expected[protein.sequence[i:i+6]].append((protein.id, i))
+
+    for kmer, hits in expected.items():
+        assert kmer_index.get(kmer) == hits
+    assert kmer_index.get("WWWWWW", []) == expected.get("WWWWWW", [])
+    assert kmer_index.get("MKR") is None
+    # U, B and lowercase letters are all packed like X
+    assert kmer_index.get("MKUWQP") == [(fasta["id"].iloc[-1], 0)]
+    assert kmer_index.get("MKBWQP") is None and "mkUWQP" not in kmer_index
+    assert len(kmer_index) == len(expected)
+
+def find_all(fasta, sequence):
+    hits = []
+    for protein, protein_sequence in enumerate(fasta["sequence"]):
+        start = protein_sequence.find(sequence)
+        while start != -1:
+            hits.append((protein, start))
+            start = protein_sequence.find(sequence, start + 1)
+    return hits
+
+def random_peptides(fasta, n=300, seed=1):
+    rng = random.Random(seed)
+    peptides = set()
+    for _ in range(n):
+        sequence = rng.choice(fasta["sequence"].tolist())
+        length = rng.randint(1, 30)
+        start = rng.randint(0, max(0, len(sequence) - length))
+        peptides.add(sequence[start:start + length])
+    peptides.update(["", "WWWWWWWWWWWWWWWWWWWW", "MKUW", "PEPTIDEB"])
+    return sorted(peptides)
+
+@pytest.mark.parametrize("mapper", [SuffixArray.from_proteome, lambda proteome: AhoCorasickMapper()])
+def test_mapper_finds_all_occurrences(mapper):
+    fasta = random_fasta()
+    proteome = Proteome.from_fasta(fasta)
+    peptides = random_peptides(fasta)
+
+    hits = mapper(proteome).map_peptides(peptides, proteome)
+    found = list(zip(hits.peptides.tolist(), hits.proteins.tolist(), hits.offsets.tolist()))
+
+    expected = [(i, protein, start) for i, peptide in enumerate(peptides) if peptide for protein, start in find_all(fasta, peptide)]
+    assert found == expected
+
+def test_kmer_index_maps_first_occurrence():
+    fasta = random_fasta()
+    proteome = Proteome.from_fasta(fasta)
+    kmer_index = KmerIndex.from_proteome(proteome, k=6)
+    peptides = random_peptides(fasta)
+
+    hits = kmer_index.map_peptides(peptides, proteome)
+    found = list(zip(hits.peptides.tolist(), hits.proteins.tolist(), hits.offsets.tolist()))
+
+    expected = []
+    for i, peptide in enumerate(peptides):
+        occurrences = find_all(fasta, peptide)
+        if len(peptide) >= 6 and occurrences:
+            expected.append((i, *occurrences[0]))
+    assert found == expected
+
+@pytest.mark.parametrize("method", ["kmer", "suffix_array"])
+def test_sharded_build_matches_serial_build(monkeypatch, method):
+    proteome = Proteome.from_fasta(random_fasta())
+    serial = build_peptide_index(proteome, method).to_arrays()
+
+    monkeypatch.setattr(sharding, "MIN_SHARD_RESIDUES", 1000)
+    assert len(sharding.protein_shards(proteome, 3)) == 3
+    sharded = build_peptide_index(proteome, method, n_workers=3).to_arrays()
+
+    assert serial.keys() == sharded.keys()
+    for name in serial:
+        assert serial[name].tolist() == sharded[name].tolist()
+
+def test_workers_default_to_one(monkeypatch):
+    monkeypatch.delenv("CLEAVVIZ_MAX_WORKERS", raising=False)
+    assert sharding.resolve_workers(None) == 1
+    assert sharding.resolve_workers(4) == 4
+
+    monkeypatch.setenv("CLEAVVIZ_MAX_WORKERS", "2")
+    assert sharding.resolve_workers(None) == 2
+    assert sharding.resolve_workers(4) == 2
+
+@pytest.mark.parametrize("method", MAPPING_METHODS)
+def test_empty_fasta_builds_empty_index(method):
+    proteome = Proteome.from_fasta(pd.DataFrame({"id": [], "sequence": []}))
+    assert sharding.protein_shards(proteome, 3) == [(0, 0)]
+
+    index = build_peptide_index(proteome, method, n_workers=3)
+    hits = index.map_peptides(["PEPTIDE"], proteome)
+    assert len(hits.peptides) == 0
+
+def test_cleavage_windows_pad_protein_ends():
+    fasta = pd.DataFrame({"id": ["P1", "P2"], "sequence": ["ACDEFGHIK", "LMNPQ"]})
+    proteome = Proteome.from_fasta(fasta)
+    windows = proteome.cleavage_windows([0, 0, 0, 1, 1, -1], [0, 2, 9, 1, 5, 3])
+
+    assert ["".join(alphabet_with_X[i] for i in window) for window in windows] == [
+        "XXXXACDE",
+        "XXACDEFG",
+        "GHIKXXXX",
+        "XXXLMNPQ",
+        "MNPQXXXX",
+        "XXXXXXXX",
+    ]
+
+def test_count_background():
+    fasta = random_fasta()
+    expected = defaultdict(int, {aa: 1 for aa in amino_acids})
+    for sequence in fasta["sequence"]:
+        for j in range(len(sequence) - 6 + 1):
+            expected[sequence[j]] += 1
+        for j in sequence[-6:]:
+            expected[j] += 1
+
+    assert count_background(Proteome.from_fasta(fasta)) == expected
+
+@pytest.mark.parametrize("method", MAPPING_METHODS)
+def test_index_cache_roundtrip(tmp_path, method):
+    fasta = random_fasta()
+    proteome = Proteome.from_fasta(fasta)
+    peptide_index = build_peptide_index(proteome, method)
+    background = count_background(proteome)
+    peptides = random_peptides(fasta)
+
+    cache = IndexCache(tmp_path)
+    digest = fasta_digest(fasta)
+    assert cache.load(digest, method) is None
+    cache.store(digest, method, proteome, peptide_index, background)
+
+    cached_proteome, cached_index, cached_background = cache.load(digest, method)
+    assert cached_proteome.ids == proteome.ids
+    assert cached_proteome.sequence == proteome.sequence
+    assert cached_background == background
+
+    expected = peptide_index.map_peptides(peptides, proteome)
+    hits = cached_index.map_peptides(peptides, cached_proteome)
+    for column in ("peptides", "proteins", "offsets"):
+        assert getattr(hits, column).tolist() == getattr(expected, column).tolist()
+
+def test_index_cache_evicts_least_recently_used(tmp_path):
+    cache = IndexCache(tmp_path)
+    for seed in range(3):
+        fasta = random_fasta(seed=seed)
+        proteome = Proteome.from_fasta(fasta)
+        cache.store(fasta_digest(fasta), "kmer", proteome, build_peptide_index(proteome, "kmer"), count_background(proteome))
+    digests = [fasta_digest(random_fasta(seed=seed)) for seed in range(3)]
+    for age, digest in enumerate(digests):
+        os.utime(tmp_path / digest, (age, age))
+
+    cache.max_bytes = IndexCache._size(tmp_path / digests[2]) + 1
+    cache.evict()
+    assert [(tmp_path / digest).exists() for digest in digests] == [False, False, True]
+
+def test_cleavage_sites_use_claimed_proteins():
+    fasta = random_fasta()
+    proteome = Proteome.from_fasta(fasta)
+    shared = fasta["sequence"][0][10:20]
+    peptide_df = pd.DataFrame({
+        "Sequence": [shared, fasta["sequence"][3][:8], "WWWWWWWWWWWWWWWWWWWW"],
+        "Protein ID": ["P50", "P3", "P1"],
+        "Start": [6, 2, 1],
+        "Sample": ["A", "A", "B"],
+        "Intensity": [1.0, 2.0, 3.0],
+    })
+
+    sites, mapping_stats = get_cleavage_sites(peptide_df, SuffixArray.from_proteome(proteome), proteome)
+    found = list(zip(sites["Sequence"], sites["proteinID"], sites["n_term_position"]))
+
+    # the shared peptide keeps its claimed protein, the wrong Start of P3 falls back to a search in P3
+    assert (shared, "P50", 5) in found
+    assert (shared, "P0", 10) not in found
+    assert (fasta["sequence"][3][:8], "P3", 0) in found
+    assert sites.loc[sites["Sequence"] == "WWWWWWWWWWWWWWWWWWWW", "proteinID"].tolist() == [None]
+    assert mapping_stats == {
+        "peptides": 3, "claimed": 3, "start_verified": 1, "protein_verified": 1, "claim_rejected": 1,
+        "fallback_searched": 1, "fallback_mapped": 0, "unmapped": 1, "memo_hits": 0,
+    }
+
+    sites, mapping_stats = get_cleavage_sites(peptide_df, SuffixArray.from_proteome(proteome), proteome, guided=False)
+    assert (shared, "P0", 10) in zip(sites["Sequence"], sites["proteinID"], sites["n_term_position"])
+    assert mapping_stats["fallback_searched"] == 3 and mapping_stats["fallback_mapped"] == 2
+
+def test_claims_come_from_one_row():
+    peptide_df = pd.DataFrame({
+        "Sequence": ["PEPTIDE", "PEPTIDE", "KMER"],
+        "Protein ID": [None, "P2", "P3"],
+        "Start": [4, 9, None],
+    })
+
+    assert get_claims(peptide_df, ["KMER", "MISSING", "PEPTIDE"]) == (["P3", None, None], [None, None, 4])
+
+def test_added_peptides_only_map_new_sequences(make_analysis):
+    fasta = random_fasta()
+    peptides = random_peptides(fasta, n=100)
+    peptide_df = pd.DataFrame({
+        "Sequence": peptides * 2,
+        "Sample": ["A"] * len(peptides) + ["B"] * len(peptides),
+        "Intensity": 1.0,
+    })
+    first_run, second_run = peptide_df[peptide_df["Sample"] == "A"], peptide_df[peptide_df["Sample"] == "B"]
+
+    incremental = make_analysis(fasta, first_run)
+    incremental.get_results("P0", None)
+    incremental.add_peptides(second_run)
+    incremental.get_results("P0", None)
+
+    complete = make_analysis(fasta, peptide_df)
+    complete.get_results("P0", None)
+
+    assert incremental.mapping_stats["memo_hits"] == len(peptides)
+    assert incremental.memo_stats["mapping"]["hit_ratio"] == 0.5
+    assert incremental.memo_stats["matching"]["hits"] > 0
+    pd.testing.assert_frame_equal(incremental._result.to_dataframe(), complete._result.to_dataframe())
+
+    # every window is matched once, shared windows are scattered back
+    stats = complete.match_stats
+    assert stats["windows"] == len(complete._result) == 2 * len(complete._peptide_df)
+    assert stats["matched"] == stats["unique_windows"] == complete._result.to_dataframe()["cleavage_site"].nunique()
+    assert stats["dedup_factor"] == stats["windows"] / stats["unique_windows"] > 1
+    assert set(stats["timings"]) == {"unique", "match", "scatter"}
+
+
+def test_changed_enzyme_selection_reuses_windows_and_matches(make_analysis):
+    fasta = random_fasta()
+    peptide_df = pd.DataFrame({"Sequence": random_peptides(fasta, n=200), "Sample": "A", "Intensity": 1.0})
+
+    incremental = make_analysis(fasta, peptide_df, top_k=3, species="Bison bison")
+    incremental.get_results("P0", None)
+    selections = [
+        {"enzymes": ["granzyme A", "Elastase", "thrombin"]},
+        {"use_standard_enzymes": False},
+        {"species": "Lama pacos"},
+    ]
+    matched, rescored = [], []
+    for settings in selections:
+        for key, value in settings.items():
+            setattr(incremental, key, value)
+        incremental.get_results("P0", None)
+        matched.append(incremental.match_stats["matched"])
+        rescored.append(incremental.match_stats["rescored"])
+
+        complete = make_analysis(fasta, peptide_df, top_k=3, species=incremental.species, enzymes=incremental.enzymes,
+                                 use_standard_enzymes=incremental.use_standard_enzymes)
+        complete.get_results("P0", None)
+        result, expected = incremental._result, complete._result
+        pd.testing.assert_frame_equal(result.to_dataframe(), expected.to_dataframe())
+        pd.testing.assert_frame_equal(result.candidate_table(), expected.candidate_table())
+
+    # the peptides are mapped once, windows are only matched again if a removed enzyme was among their candidates
+    assert incremental.stage_stats["windows"] == 1
+    assert incremental.stage_stats["matches"] == len(selections) + 1
+    assert matched[0] == 0 and rescored[0] > 0
+    assert 0 < matched[1] < incremental.match_stats["unique_windows"]
+
+
+def test_empty_inputs_give_empty_results(make_analysis):
+    peptides = pd.DataFrame({"Sequence": ["PEPTIDEK"], "Sample": ["A"], "Intensity": [1.0]})
+    no_peptides = peptides.iloc[:0].astype({"Sequence": float})
+    inputs = [(pd.DataFrame({"id": [], "sequence": []}), peptides), (random_fasta(), no_peptides)]
+
+    for fasta, peptide_df in inputs:
+        assert make_analysis(fasta, peptide_df).get_results("P0", None) == {}
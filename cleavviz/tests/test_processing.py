@@ -0,0 +1,49 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from src.cleavviz.processing import calculate_count_sum, find_peptide_position, verify_peptide_positions
+from src.cleavviz.constants import AggregationMethod, PeptideDF
+
+PROTEIN = "MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQ"
+
+def reference_count_sum(protein_sequence, peptides, aggregation):
+    '''Aggregation that searches every peptide in the protein sequence.'''
+    grouped = peptides.groupby(PeptideDF.PEPTIDE_SEQUENCE)[PeptideDF.INTENSITY].agg(aggregation)
+    count = [0] * len(protein_sequence)
+    intensity = [0] * len(protein_sequence)
+    for sequence, peptide_intensity in grouped.items():
+        start, end = find_peptide_position(protein_sequence, sequence)
+        if start is None or math.isnan(peptide_intensity) or int(peptide_intensity) <= 0:
+            continue
+        for i in range(start - 1, end):
+            intensity[i] += int(peptide_intensity)
+            count[i] += 1
+    return count, intensity
+
+def peptides():
+    return pd.DataFrame({
+        PeptideDF.PEPTIDE_SEQUENCE: ["KTAYIAK", "KTAYIAK", "SFVKSHF", "LEERLGL", "QAPILSR", "GDGTQDN", "WWWWW", "AVQVK"],
+        PeptideDF.INTENSITY: [3.0, 5.0, 2.5, np.nan, 4.0, 0.0, 7.0, 1.0],
+        # wrong Start for SFVKSHF, out of range for QAPILSR, missing for AVQVK
+        PeptideDF.START: [2, 2, 20, 23, 500, 41, 1, None],
+    })
+
+def test_verify_peptide_positions():
+    table = peptides()
+    verified = verify_peptide_positions(PROTEIN, table[PeptideDF.PEPTIDE_SEQUENCE].tolist(), table[PeptideDF.START])
+    assert verified.tolist() == [True, True, False, True, False, True, False, False]
+
+@pytest.mark.parametrize("method, aggregation", [(AggregationMethod.SUM, "sum"), (AggregationMethod.MEAN, "mean"), (AggregationMethod.MEDIAN, "median")])
+def test_count_sum_matches_search(method, aggregation):
+    table = peptides()
+    expected = reference_count_sum(PROTEIN, table, aggregation)
+
+    assert calculate_count_sum(PROTEIN, table, method) == expected
+    assert calculate_count_sum(PROTEIN, table.drop(columns=PeptideDF.START), method) == expected
+
+def test_count_sum_with_text_starts():
+    table = peptides()
+    table[PeptideDF.START] = ["2.0", "2", "20", "23.0", "500", "abc", "1", None]
+
+    assert calculate_count_sum(PROTEIN, table, AggregationMethod.SUM) == reference_count_sum(PROTEIN, table, "sum")
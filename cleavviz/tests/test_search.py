@@ -0,0 +1,11 @@
+from src.cleavviz.cleavage_calculation.search import SearchIndex
+
+def test_search_is_ranked_and_case_insensitive():
+    index = SearchIndex(["Trypsin 2", "Chymotrypsin A", "trypsin", "Trypsin 1", "Elastase", "Tr"])
+
+    assert index.search(None) == index.items
+    assert index.search("TRYPSIN") == ["trypsin", "Trypsin 2", "Trypsin 1", "Chymotrypsin A"]
+    assert index.search("tr") == ["Tr", "Trypsin 2", "trypsin", "Trypsin 1", "Chymotrypsin A"]
+    assert index.search("trypsin", limit=2, offset=1) == ["Trypsin 2", "Trypsin 1"]
+    assert index.search("sin a") == ["Chymotrypsin A"]
+    assert index.search("pepsin") == []
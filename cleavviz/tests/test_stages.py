@@ -0,0 +1,15 @@
+from src.cleavviz.cleavage_calculation.stages import StageGraph
+
+def test_invalidate_marks_downstream_stages():
+    graph = StageGraph({"a": (), "b": ("a",), "c": (), "d": ("b", "c")})
+    assert graph.pending() == ["a", "b", "c", "d"]
+
+    for stage in graph.pending():
+        graph.done(stage)
+    graph.invalidate("c")
+    assert graph.pending() == ["c", "d"]
+    assert graph.is_stale("d") and not graph.is_stale("b")
+
+    graph.invalidate("a")
+    assert graph.pending() == ["a", "b", "c", "d"]
+    assert graph.stats() == {"a": 1, "b": 1, "c": 1, "d": 1}
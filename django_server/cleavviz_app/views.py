@@ -66,23 +66,41 @@ def proteins_view(request):
 
     return JsonResponse({"proteins": proteins})
 
+def get_query_int(request, name, default):
+    """
+    Read an optional non-negative integer query parameter, malformed values fall back to the default.
+    """
+    try:
+        return max(0, int(request.GET.get(name)))
+    except (TypeError, ValueError):
+        return default
+
+def get_page(request):
+    """
+    Read the optional limit and offset of a search request.
+    """
+    limit = get_query_int(request, 'limit', None)
+    offset = get_query_int(request, 'offset', 0)
+
+    return limit, offset
+
 def enzymes_view(request):
     """
-    Get list of enzymes.
+    Get list of enzymes, ranked by how well they match the filter.
     """
     
     filter = request.GET.get('filter')
-    enzymes = enrichment_analysis.search_enzymes(filter)
+    enzymes = enrichment_analysis.search_enzymes(filter, *get_page(request))
 
     return JsonResponse({"enzymes": enzymes})
 
 def species_view(request):
     """
-    Get list of species.
+    Get list of species, ranked by how well they match the filter.
     """
 
     filter = request.GET.get('filter')
-    species = enrichment_analysis.search_species(filter)
+    species = enrichment_analysis.search_species(filter, *get_page(request))
 
     return JsonResponse({"species": species})
 